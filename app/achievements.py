@@ -0,0 +1,162 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from app import metrics
+from app.database import db_session
+from app.utils import process_achievement_event
+
+load_dotenv()
+
+ACHIEVEMENT_BATCH_SIZE = int(os.getenv("ACHIEVEMENT_BATCH_SIZE", 200))
+ACHIEVEMENT_POLL_INTERVAL_SECONDS = float(os.getenv("ACHIEVEMENT_POLL_INTERVAL_SECONDS", 1))
+ACHIEVEMENT_MAX_ATTEMPTS = int(os.getenv("ACHIEVEMENT_MAX_ATTEMPTS", 3))
+
+# Пространство ключей advisory-блокировок: события одного пользователя обрабатывает только один обработчик
+ACHIEVEMENT_LOCK_KEY = 2101
+
+_worker = None
+_wakeup = None
+
+# Запись события в outbox в транзакции вызывающего кода (фиксируется вместе с изменением прогресса или задачи)
+async def record_event(db, event_type: str, user_id: int, task_complete: bool = None):
+    await db.execute(
+        text("""
+            INSERT INTO achievement_events (user_id, event_type, task_complete)
+            VALUES (:user_id, :event_type, :task_complete)
+        """),
+        {"user_id": user_id, "event_type": event_type, "task_complete": task_complete}
+    )
+
+# Сигнал обработчику после фиксации транзакции с событиями
+def notify():
+    if _wakeup is not None:
+        _wakeup.set()
+
+# Применение одного события в точке сохранения: ошибка откатывает только это событие, а не всю пачку
+async def _apply_event(db, event):
+    await db.execute(text("SAVEPOINT achievement_event"))
+    try:
+        await process_achievement_event(db, event.event_type, event.user_id, event.task_complete)
+    except Exception:
+        await db.execute(text("ROLLBACK TO SAVEPOINT achievement_event"))
+        raise
+    await db.execute(text("RELEASE SAVEPOINT achievement_event"))
+
+# Ошибка события: счётчик попыток увеличивается, после ACHIEVEMENT_MAX_ATTEMPTS попыток событие откладывается
+async def _fail_event(db, event, error: str) -> bool:
+    return (await db.execute(
+        text("""
+            UPDATE achievement_events
+            SET attempts = attempts + 1, error = :error,
+                failed_at = CASE WHEN attempts + 1 >= :max_attempts THEN NOW() END
+            WHERE id = :event_id
+            RETURNING failed_at IS NOT NULL
+        """),
+        {"event_id": event.id, "error": error, "max_attempts": ACHIEVEMENT_MAX_ATTEMPTS}
+    )).scalar()
+
+# Обработка пачки событий одной транзакцией: применённые события удаляются из outbox в той же транзакции,
+# поэтому каждое событие применяется ровно один раз.
+# События пользователя применяются в порядке записи; после ошибки остальные события этого пользователя
+# ждут следующей пачки. Пользователи, занятые другим обработчиком, пропускаются
+async def process_events() -> int:
+    async with db_session() as db:
+        user_ids = (await db.execute(
+            text("""
+                SELECT user_id FROM achievement_events
+                WHERE failed_at IS NULL
+                GROUP BY user_id
+                ORDER BY MIN(id)
+                LIMIT :limit
+            """),
+            {"limit": ACHIEVEMENT_BATCH_SIZE}
+        )).scalars().all()
+
+        if not user_ids:
+            return 0
+
+        locked_user_ids = (await db.execute(
+            text("""
+                SELECT user_id FROM unnest(CAST(:user_ids AS INTEGER[])) AS user_id
+                WHERE pg_try_advisory_xact_lock(:lock_key, user_id)
+            """),
+            {"user_ids": user_ids, "lock_key": ACHIEVEMENT_LOCK_KEY}
+        )).scalars().all()
+
+        if not locked_user_ids:
+            return 0
+
+        events = (await db.execute(
+            text("""
+                SELECT id, user_id, event_type, task_complete FROM achievement_events
+                WHERE user_id = ANY(CAST(:user_ids AS INTEGER[])) AND failed_at IS NULL
+                ORDER BY id
+                LIMIT :limit
+            """),
+            {"user_ids": locked_user_ids, "limit": ACHIEVEMENT_BATCH_SIZE}
+        )).fetchall()
+
+        applied_ids = []
+        failed_user_ids = set()
+        parked = 0
+        for event in events:
+            if event.user_id in failed_user_ids:
+                continue
+
+            try:
+                await _apply_event(db, event)
+                applied_ids.append(event.id)
+            except Exception as e:
+                failed_user_ids.add(event.user_id)
+                parked += await _fail_event(db, event, str(e) or e.__class__.__name__)
+
+        if applied_ids:
+            await db.execute(
+                text("DELETE FROM achievement_events WHERE id = ANY(CAST(:event_ids AS BIGINT[]))"),
+                {"event_ids": applied_ids}
+            )
+        await db.commit()
+
+    metrics.inc("achievement_events_applied_total", len(applied_ids))
+    if failed_user_ids:
+        metrics.inc("achievement_events_failed_total", len(failed_user_ids))
+    if parked:
+        metrics.inc("achievement_events_parked_total", parked)
+    return len(applied_ids)
+
+async def _worker_loop():
+    while True:
+        try:
+            if await process_events() >= ACHIEVEMENT_BATCH_SIZE:
+                continue
+        except Exception:
+            # Ошибка всей пачки (например, недоступна БД): события остаются в outbox до следующей попытки
+            metrics.inc("achievement_batches_failed_total")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), ACHIEVEMENT_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+# Запуск обработчика событий (в lifespan приложения)
+def start_achievement_worker():
+    global _worker, _wakeup
+    if _worker is not None:
+        return
+
+    _wakeup = asyncio.Event()
+    _worker = asyncio.create_task(_worker_loop())
+
+# Остановка обработчика; необработанные события остаются в outbox до следующего запуска
+async def stop_achievement_worker():
+    global _worker, _wakeup
+    if _worker is None:
+        return
+
+    _worker.cancel()
+    await asyncio.gather(_worker, return_exceptions=True)
+    _worker = None
+    _wakeup = None
@@ -0,0 +1,265 @@
+import asyncio
+from contextlib import asynccontextmanager
+from functools import cached_property, partial
+import hashlib
+import os
+import time
+from dotenv import load_dotenv
+from fastapi import HTTPException
+import httpx
+from gigachat import GigaChat
+from gigachat.client import _get_kwargs
+
+from app import metrics
+
+load_dotenv()
+
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", 60))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", 16))
+AI_KEEPALIVE_SECONDS = float(os.getenv("AI_KEEPALIVE_SECONDS", 60))
+AI_TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("AI_TOKEN_REFRESH_MARGIN_SECONDS", 60))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", AI_MAX_CONNECTIONS))
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", 64))
+AI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("AI_QUEUE_TIMEOUT_SECONDS", 10))
+AI_CALL_TIMEOUT_SECONDS = float(os.getenv("AI_CALL_TIMEOUT_SECONDS", 90))
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("AI_BREAKER_FAILURE_THRESHOLD", 5))
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", 30))
+
+client = None
+_token_lock = asyncio.Lock()
+
+# Автомат защиты: после AI_BREAKER_FAILURE_THRESHOLD ошибок подряд запросы к нейросети сразу отклоняются,
+# через AI_BREAKER_RESET_SECONDS пропускается один пробный запрос
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self.state = "half_open"
+            self._trial_in_flight = False
+
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                metrics.inc("ai_breaker_opened_total")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    # Пробный запрос не дошёл до нейросети (отмена клиентом) - его место освобождается
+    def release_trial(self):
+        self._trial_in_flight = False
+
+breaker = CircuitBreaker(AI_BREAKER_FAILURE_THRESHOLD, AI_BREAKER_RESET_SECONDS)
+
+# Отдельный лимит одновременных запросов к нейросети и длины очереди к нему,
+# чтобы медленный внешний сервис не забирал ресурсы остального API
+_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+_active = 0
+_waiting = 0
+
+# Запросы к нейросети в процессе выполнения: хэш промпта -> задача
+_in_flight = {}
+
+# Клиент GigaChat с ограниченным пулом keep-alive соединений к API
+class PooledGigaChat(GigaChat):
+    @cached_property
+    def _aclient(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            **_get_kwargs(self._settings),
+            limits=httpx.Limits(
+                max_connections=AI_MAX_CONNECTIONS,
+                max_keepalive_connections=AI_MAX_CONNECTIONS,
+                keepalive_expiry=AI_KEEPALIVE_SECONDS,
+            ),
+        )
+
+# Создание общего для всего приложения клиента GigaChat
+def init_ai_client():
+    global client
+    if client is not None:
+        return client
+
+    client = PooledGigaChat(
+        credentials=os.getenv("GIGACHAT_AUTHORIZATION_KEY"),
+        verify_ssl_certs=False,
+        scope="GIGACHAT_API_PERS",
+        timeout=AI_TIMEOUT_SECONDS,
+    )
+    return client
+
+# Закрытие соединений клиента при остановке приложения
+async def close_ai_client():
+    global client
+    if client is None:
+        return
+
+    await client.aclose()
+    client = None
+
+# Получение токена доступа, если его ещё нет или он скоро истечёт.
+# Под блокировкой, чтобы одновременные запросы не обменивали ключ на токен каждый сам по себе
+async def ensure_token(giga: GigaChat):
+    if _is_token_valid(giga):
+        return
+
+    async with _token_lock:
+        if _is_token_valid(giga):
+            return
+
+        started = time.perf_counter()
+        await giga.aget_token()
+        metrics.inc("ai_token_refresh_total")
+        metrics.observe("ai_token_refresh_seconds", time.perf_counter() - started)
+
+def _is_token_valid(giga: GigaChat) -> bool:
+    if not giga._use_auth:
+        return True
+
+    token = giga._access_token
+    return token is not None and token.expires_at / 1000 - AI_TOKEN_REFRESH_MARGIN_SECONDS > time.time()
+
+def _reject(reason: str):
+    metrics.inc(f"ai_rejected_{reason}_total")
+    raise HTTPException(status_code=503, detail="Сервис нейросети временно недоступен, повторите запрос позже")
+
+# Проверка автомата защиты до начала работы с нейросетью
+def ensure_available():
+    if breaker.state == "open" and time.monotonic() - breaker._opened_at < breaker.reset_seconds:
+        _reject("breaker")
+
+# Место в ограниченном пуле запросов к нейросети; при открытом автомате, переполненной очереди
+# или долгом ожидании запрос отклоняется с 503
+@asynccontextmanager
+async def _bulkhead():
+    global _active, _waiting
+    if not breaker.allow():
+        _reject("breaker")
+
+    if not _semaphore.locked():
+        await _semaphore.acquire()
+    else:
+        if _waiting >= AI_MAX_QUEUE:
+            breaker.release_trial()
+            _reject("queue_full")
+
+        _waiting += 1
+        try:
+            await asyncio.wait_for(_semaphore.acquire(), AI_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            breaker.release_trial()
+            _reject("queue_timeout")
+        except BaseException:
+            breaker.release_trial()
+            raise
+        finally:
+            _waiting -= 1
+
+    _active += 1
+    try:
+        yield
+    except Exception:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release_trial()
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        _active -= 1
+        _semaphore.release()
+
+async def _chat(giga: GigaChat, prompt: str):
+    await ensure_token(giga)
+    return await giga.achat(prompt)
+
+# Запрос к GigaChat, возвращает текст ответа модели.
+# Одинаковые промпты, отправленные одновременно, обслуживаются одним запросом к нейросети
+async def chat(prompt: str, coalesce: bool = True) -> str:
+    if not coalesce:
+        return await _chat_upstream(prompt)
+
+    key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(_chat_upstream(prompt))
+        _in_flight[key] = task
+        task.add_done_callback(partial(_finish_in_flight, key))
+    else:
+        metrics.inc("ai_coalesced_total")
+
+    # Отмена одного из ожидающих не отменяет общий запрос для остальных
+    return await asyncio.shield(task)
+
+def _finish_in_flight(key: str, task: asyncio.Task):
+    _in_flight.pop(key, None)
+    if not task.cancelled():
+        task.exception()
+
+async def _chat_upstream(prompt: str) -> str:
+    giga = init_ai_client()
+
+    async with _bulkhead():
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(_chat(giga, prompt), AI_CALL_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            metrics.inc("ai_timeouts_total")
+            raise TimeoutError("Превышено время ожидания ответа нейросети") from None
+        finally:
+            metrics.observe("ai_request_seconds", time.perf_counter() - started)
+
+    return response.choices[0].message.content
+
+# Потоковый запрос к GigaChat: фрагменты ответа модели по мере генерации
+async def stream(prompt: str):
+    giga = init_ai_client()
+
+    async with _bulkhead():
+        started = time.perf_counter()
+        try:
+            await ensure_token(giga)
+            async for chunk in giga.astream(prompt):
+                if time.perf_counter() - started > AI_CALL_TIMEOUT_SECONDS:
+                    metrics.inc("ai_timeouts_total")
+                    raise TimeoutError("Превышено время ожидания ответа нейросети")
+
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            metrics.observe("ai_stream_seconds", time.perf_counter() - started)
+
+def _ai_status() -> dict:
+    return {
+        "breaker": breaker.state,
+        "consecutive_failures": breaker.failures,
+        "active": _active,
+        "waiting": _waiting,
+        "in_flight": len(_in_flight),
+        "max_concurrency": AI_MAX_CONCURRENCY,
+        "max_queue": AI_MAX_QUEUE,
+    }
+
+metrics.register_gauge("ai", _ai_status)
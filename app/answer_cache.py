@@ -0,0 +1,117 @@
+import hashlib
+import os
+import random
+import re
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from app import metrics
+from app.cache import TTLCache
+
+load_dotenv()
+
+AI_ANSWER_CACHE_TTL_SECONDS = float(os.getenv("AI_ANSWER_CACHE_TTL_SECONDS", 86400))
+AI_ANSWER_CACHE_MAX_SIZE = int(os.getenv("AI_ANSWER_CACHE_MAX_SIZE", 5000))
+AI_ANSWER_CACHE_PERSISTENT = os.getenv("AI_ANSWER_CACHE_PERSISTENT", "true").lower() == "true"
+AI_ANSWER_CACHE_PURGE_PROBABILITY = float(os.getenv("AI_ANSWER_CACHE_PURGE_PROBABILITY", 0.01))
+AI_ANSWER_CACHE_PURGE_BATCH_SIZE = int(os.getenv("AI_ANSWER_CACHE_PURGE_BATCH_SIZE", 1000))
+
+# Кэш ответов нейросети на вопросы по урокам: ключ (урок, хэш содержимого урока, хэш нормализованного вопроса).
+# Первый уровень - память процесса (LRU), второй - таблица ai_answer_cache, общая для всех процессов
+_answers = TTLCache(maxsize=AI_ANSWER_CACHE_MAX_SIZE, ttl=AI_ANSWER_CACHE_TTL_SECONDS)
+
+# Нормализация вопроса: регистр, ё, лишние пробелы и знаки препинания в конце не влияют на ключ
+def normalize_question(question: str) -> str:
+    question = question.lower().replace("ё", "е")
+    question = re.sub(r"\s+", " ", question).strip()
+    return question.rstrip(" ?!.…")
+
+def question_hash(question: str) -> str:
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+# Хэш всего, что из урока попадает в промпт: при изменении урока ключи кэша меняются сами
+def lesson_content_hash(lesson) -> str:
+    content = "\x00".join(str(value or "") for value in (lesson.title, lesson.description, lesson.education_content))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+# Поиск ответа в кэше
+async def get_answer(db, lesson, question: str):
+    key = (lesson.id, lesson_content_hash(lesson), question_hash(question))
+
+    cached = _answers.get(key)
+    if cached is not None:
+        metrics.inc("ai_answer_cache_memory_hits_total")
+        return cached[1]
+
+    if AI_ANSWER_CACHE_PERSISTENT:
+        answer = (await db.execute(
+            text("""
+                SELECT answer FROM ai_answer_cache
+                WHERE lesson_id = :lesson_id AND content_hash = :content_hash AND question_hash = :question_hash
+                  AND created_at > NOW() - make_interval(secs => :ttl)
+            """),
+            {"lesson_id": key[0], "content_hash": key[1], "question_hash": key[2], "ttl": AI_ANSWER_CACHE_TTL_SECONDS}
+        )).scalar()
+
+        if answer is not None:
+            metrics.inc("ai_answer_cache_db_hits_total")
+            _answers.set(key, (lesson.id, answer))
+            return answer
+
+    metrics.inc("ai_answer_cache_misses_total")
+    return None
+
+# Сохранение ответа в кэш (запись в БД фиксируется вызывающим кодом)
+async def save_answer(db, lesson, question: str, answer: str):
+    key = (lesson.id, lesson_content_hash(lesson), question_hash(question))
+    _answers.set(key, (lesson.id, answer))
+
+    if AI_ANSWER_CACHE_PERSISTENT:
+        await db.execute(
+            text("""
+                INSERT INTO ai_answer_cache (lesson_id, content_hash, question_hash, question, answer)
+                VALUES (:lesson_id, :content_hash, :question_hash, :question, :answer)
+                ON CONFLICT (lesson_id, content_hash, question_hash)
+                DO UPDATE SET answer = EXCLUDED.answer, created_at = NOW()
+            """),
+            {
+                "lesson_id": key[0],
+                "content_hash": key[1],
+                "question_hash": key[2],
+                "question": normalize_question(question),
+                "answer": answer
+            }
+        )
+
+        # Очистка таблицы от устаревших ответов: примерно при каждом 1/AI_ANSWER_CACHE_PURGE_PROBABILITY сохранении
+        if random.random() < AI_ANSWER_CACHE_PURGE_PROBABILITY:
+            await purge_expired(db)
+
+# Удаление из таблицы ответов старше AI_ANSWER_CACHE_TTL_SECONDS, не больше пачки за раз
+# (запись в БД фиксируется вызывающим кодом)
+async def purge_expired(db) -> int:
+    purged = (await db.execute(
+        text("""
+            DELETE FROM ai_answer_cache
+            WHERE (lesson_id, content_hash, question_hash) IN (
+                SELECT lesson_id, content_hash, question_hash FROM ai_answer_cache
+                WHERE created_at <= NOW() - make_interval(secs => :ttl)
+                LIMIT :limit
+            )
+        """),
+        {"ttl": AI_ANSWER_CACHE_TTL_SECONDS, "limit": AI_ANSWER_CACHE_PURGE_BATCH_SIZE}
+    )).rowcount
+
+    if purged:
+        metrics.inc("ai_answer_cache_purged_total", purged)
+    return purged
+
+# Удаление ответов по уроку после его изменения (запись в БД фиксируется вызывающим кодом)
+async def invalidate_lesson(db, lesson_id: int):
+    _answers.discard_where(lambda value: value[0] == lesson_id)
+
+    if AI_ANSWER_CACHE_PERSISTENT:
+        await db.execute(
+            text("DELETE FROM ai_answer_cache WHERE lesson_id = :lesson_id"),
+            {"lesson_id": lesson_id}
+        )
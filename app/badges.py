@@ -0,0 +1,46 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+import os
+import time
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv()
+
+BADGE_CATALOG_TTL_SECONDS = float(os.getenv("BADGE_CATALOG_TTL_SECONDS", 300))
+
+# Каталог достижений в памяти процесса: для каждого badge_type пороги по возрастанию и id достижений в том же порядке
+@dataclass(frozen=True)
+class BadgeCatalog:
+    thresholds: dict
+    expires_at: float
+
+_catalog = None
+
+# Сброс каталога после изменения таблицы badges
+def invalidate_badge_catalog():
+    global _catalog
+    _catalog = None
+
+async def get_badge_catalog(db) -> BadgeCatalog:
+    global _catalog
+    if _catalog is not None and _catalog.expires_at > time.monotonic():
+        return _catalog
+
+    badges = (await db.execute(
+        text("SELECT id, badge_type, badge_value FROM badges ORDER BY badge_type, badge_value, id")
+    )).fetchall()
+
+    thresholds = {}
+    for badge in badges:
+        values, badge_ids = thresholds.setdefault(badge.badge_type, ([], []))
+        values.append(badge.badge_value)
+        badge_ids.append(badge.id)
+
+    _catalog = BadgeCatalog(thresholds=thresholds, expires_at=time.monotonic() + BADGE_CATALOG_TTL_SECONDS)
+    return _catalog
+
+# Достижения, пороги которых пройдены при росте показателя с old_value до new_value (old_value < порог <= new_value)
+def crossed_badges(catalog: BadgeCatalog, badge_type: str, old_value: int, new_value: int) -> list:
+    values, badge_ids = catalog.thresholds.get(badge_type, ([], []))
+    return badge_ids[bisect_right(values, old_value):bisect_right(values, new_value)]
@@ -0,0 +1,155 @@
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+import os
+import time
+import anyio
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_ASYNC_MODE = os.getenv("DB_ASYNC_MODE", "true").lower() == "true"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 2))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", DB_POOL_SIZE))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 15000))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", os.getenv("PROJECT_NAME", "edunext"))
+
+engine = None
+SessionLocal = None
+
+# Сессия синхронного драйвера (psycopg2) с тем же async-интерфейсом, что и AsyncSession.
+# Каждый вызов выполняется в пуле потоков anyio — так работает режим DB_ASYNC_MODE=false
+class ThreadedSession:
+    def __init__(self, session):
+        self._session = session
+
+    async def _run(self, func, *args, **kwargs):
+        return await anyio.to_thread.run_sync(partial(func, *args, **kwargs))
+
+    async def execute(self, *args, **kwargs):
+        return await self._run(self._session.execute, *args, **kwargs)
+
+    async def connection(self):
+        return await self._run(self._session.connection)
+
+    async def commit(self):
+        await self._run(self._session.commit)
+
+    async def rollback(self):
+        await self._run(self._session.rollback)
+
+    async def close(self):
+        await self._run(self._session.close)
+
+# Создание общего для всего приложения движка и пула соединений
+def init_engine():
+    global engine, SessionLocal
+    if engine is not None:
+        return engine
+
+    pool_options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+    if DB_ASYNC_MODE:
+        engine = create_async_engine(
+            make_url(DATABASE_URL).set(drivername="postgresql+asyncpg"),
+            connect_args={
+                "server_settings": {
+                    "application_name": DB_APPLICATION_NAME,
+                    "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+                },
+            },
+            **pool_options,
+        )
+        SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    else:
+        engine = create_engine(
+            DATABASE_URL,
+            connect_args={
+                "application_name": DB_APPLICATION_NAME,
+                "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+            },
+            **pool_options,
+        )
+        SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+    return engine
+
+# Закрытие всех соединений пула при остановке приложения
+async def dispose_engine():
+    global engine
+    if engine is None:
+        return
+
+    if DB_ASYNC_MODE:
+        await engine.dispose()
+    else:
+        engine.dispose()
+    engine = None
+
+# Прогрев пула: заранее открываем соединения, чтобы первые запросы после запуска не ждали подключения
+async def warm_up_pool():
+    async with AsyncExitStack() as stack:
+        for _ in range(min(DB_POOL_WARMUP, DB_POOL_SIZE)):
+            db = await stack.enter_async_context(db_session())
+            await db.execute(text("SELECT 1"))
+
+def _pool_status() -> dict:
+    if engine is None:
+        return {}
+
+    return {
+        "mode": "asyncpg" if DB_ASYNC_MODE else "psycopg2",
+        "size": engine.pool.size(),
+        "checked_out": engine.pool.checkedout(),
+        "overflow": engine.pool.overflow(),
+    }
+
+metrics.register_gauge("db_pool", _pool_status)
+
+def _new_session():
+    if DB_ASYNC_MODE:
+        return SessionLocal()
+    return ThreadedSession(SessionLocal())
+
+# Сессия БД с гарантированным возвратом соединения в пул
+@asynccontextmanager
+async def db_session():
+    db = _new_session()
+    try:
+        started = time.perf_counter()
+        try:
+            await db.connection()
+        except PoolTimeoutError:
+            metrics.inc("db_pool_timeouts_total")
+            raise HTTPException(status_code=503, detail="Сервер перегружен, повторите запрос позже")
+        finally:
+            metrics.observe("db_pool_checkout_wait_seconds", time.perf_counter() - started)
+
+        yield db
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+
+# Зависимость FastAPI: сессия БД на время обработки запроса
+async def get_db():
+    async with db_session() as db:
+        yield db
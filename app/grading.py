@@ -0,0 +1,101 @@
+import ast
+import math
+import re
+
+from app import metrics
+
+GRADING_MAX_CODE_LENGTH = 10000
+
+# Знаки препинания предложения, которые не влияют на смысл текстового ответа (скобки, кавычки и операторы сохраняются)
+_PUNCTUATION = re.compile(r"[.,!?;:…]")
+# Скобки и кавычки меняют смысл ответа ("[1, 2]" и "(1, 2)", "5" в кавычках и 5): такие ответы без точного совпадения проверяет нейросеть
+_BRACKETS_AND_QUOTES = re.compile(r"[()\[\]{}\"'«»“”„]")
+# Число с точкой или запятой в качестве десятичного разделителя, без разделителей разрядов; nan и inf не числа
+_NUMBER = re.compile(r"[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?")
+# Узлы, по которым видно, что ответ - код, а не одно слово или число
+_CODE_NODES = (ast.Call, ast.Assign, ast.AugAssign, ast.FunctionDef, ast.For, ast.While, ast.If, ast.Return, ast.Import, ast.ImportFrom, ast.ClassDef)
+
+_verdicts = {"local": 0, "llm": 0}
+
+# Нормализация текстового ответа: регистр, ё, пунктуация и пробелы
+def normalize_answer(answer: str) -> str:
+    answer = answer.lower().replace("ё", "е")
+    answer = _PUNCTUATION.sub(" ", answer)
+    return re.sub(r"\s+", " ", answer).strip()
+
+# Значение числового ответа; None, если ответ не число или запись неоднозначна.
+# Запятая считается десятичным разделителем, только если она единственная, точки нет
+# и это не разделитель разрядов ("1,000" может быть и 1, и 1000)
+def _parse_number(answer: str):
+    answer = answer.strip()
+    if "," in answer:
+        if "." in answer or answer.count(",") > 1 or re.fullmatch(r"[+-]?\d{1,3},\d{3}", answer):
+            return None
+        answer = answer.replace(",", ".")
+
+    if not _NUMBER.fullmatch(answer):
+        return None
+
+    value = float(answer)
+    return value if math.isfinite(value) else None
+
+# Дерево разбора кода без позиций в исходнике; None, если ответ не похож на код
+def _parse_code(answer: str):
+    if len(answer) > GRADING_MAX_CODE_LENGTH:
+        return None
+
+    try:
+        tree = ast.parse(answer.strip())
+    except (SyntaxError, ValueError):
+        return None
+
+    if not any(isinstance(node, _CODE_NODES) for node in ast.walk(tree)):
+        return None
+    return ast.dump(tree, annotate_fields=False, include_attributes=False)
+
+# Локальная проверка ответа до запроса к нейросети.
+# True/False - уверенный вердикт, None - решение остаётся за нейросетью
+def pre_grade(answer: str, answer_right: str):
+    if not answer_right:
+        return None
+
+    if not answer.strip():
+        return False
+
+    # Числовой ответ: сравнение значений ("5" и "5,0" совпадают)
+    answer_number, right_number = _parse_number(answer), _parse_number(answer_right)
+    if answer_number is not None and right_number is not None:
+        return abs(answer_number - right_number) < 1e-9
+
+    # Код: сравнение деревьев разбора (пробелы, комментарии, вид кавычек и скобок не важны)
+    answer_code, right_code = _parse_code(answer), _parse_code(answer_right)
+    if answer_code is not None and right_code is not None:
+        return True if answer_code == right_code else None
+
+    # Ответ со скобками или кавычками ("[1, 2]", "len(s)", '"5"') уверенно верен только при точном совпадении
+    if _BRACKETS_AND_QUOTES.search(answer) or _BRACKETS_AND_QUOTES.search(answer_right):
+        return True if answer.strip() == answer_right.strip() else None
+
+    # Ответ только из знаков препинания ("...", "?"): после нормализации пуст, сравнивается как есть
+    normalized_answer, normalized_right = normalize_answer(answer), normalize_answer(answer_right)
+    if not normalized_answer or not normalized_right:
+        return True if answer.strip() == answer_right.strip() else None
+
+    # Уверенно верным считается только полное совпадение: те же слова в другом порядке
+    # могут менять смысл ("a больше b" и "b больше a"), такие ответы проверяет нейросеть
+    if normalized_answer == normalized_right:
+        return True
+
+    return None
+
+# Учёт того, кто вынес вердикт: локальная проверка или нейросеть
+def record_verdict(local: bool):
+    kind = "local" if local else "llm"
+    _verdicts[kind] += 1
+    metrics.inc(f"grading_{kind}_total")
+
+def _grading_status() -> dict:
+    total = _verdicts["local"] + _verdicts["llm"]
+    return {**_verdicts, "local_share": _verdicts["local"] / total if total else 0.0}
+
+metrics.register_gauge("grading", _grading_status)
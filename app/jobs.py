@@ -0,0 +1,232 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from app import ai, metrics, task_pool
+from app.database import db_session
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", 30))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 300))
+
+_workers = []
+_wakeup = None
+_running_job_ids = set()
+
+# Постановка задания в очередь (запись в БД фиксируется вызывающим кодом)
+async def enqueue_job(db, kind: str, user_id: int, lesson_id: int) -> int:
+    return (await db.execute(
+        text("INSERT INTO jobs (kind, user_id, lesson_id) VALUES (:kind, :user_id, :lesson_id) RETURNING id"),
+        {"kind": kind, "user_id": user_id, "lesson_id": lesson_id}
+    )).scalar()
+
+# Сигнал обработчикам, что в очереди появилось задание
+def notify():
+    if _wakeup is not None:
+        _wakeup.set()
+
+# Возврат в очередь заданий, которые остались в статусе running после остановки или падения процесса.
+# Задание, исчерпавшее JOB_MAX_ATTEMPTS попыток (например, каждый раз роняющее процесс), завершается с ошибкой
+async def recover_stale_jobs() -> int:
+    async with db_session() as db:
+        jobs = (await db.execute(
+            text("""
+                UPDATE jobs
+                SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'queued' END,
+                    error = CASE WHEN attempts >= :max_attempts THEN 'Задание прервано: исчерпаны попытки' ELSE error END,
+                    updated_at = NOW()
+                WHERE status = 'running' AND updated_at < NOW() - make_interval(secs => :stale_seconds)
+                RETURNING status
+            """),
+            {"stale_seconds": JOB_STALE_SECONDS, "max_attempts": JOB_MAX_ATTEMPTS}
+        )).fetchall()
+        await db.commit()
+
+    recovered = sum(1 for job in jobs if job.status == "queued")
+    if recovered:
+        metrics.inc("jobs_recovered_total", recovered)
+    if len(jobs) > recovered:
+        metrics.inc("jobs_failed_total", len(jobs) - recovered)
+    return recovered
+
+# Захват следующего задания: параллельные обработчики (в том числе других процессов) не получают одно задание
+async def claim_job():
+    async with db_session() as db:
+        job = (await db.execute(
+            text("""
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = NOW()
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = 'queued' AND run_after <= NOW()
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, kind, user_id, lesson_id, attempts
+            """)
+        )).fetchone()
+        await db.commit()
+    return job
+
+# Сохранение сгенерированной задачи пользователя и завершение задания одной транзакцией.
+# Если задание за это время было возвращено в очередь и выполнено другим обработчиком, результат отбрасывается
+async def _complete_generate_task(db, job, task: str, answer_right: str) -> bool:
+    task_id = (await db.execute(
+        text("""
+            INSERT INTO tasks (user_id, lesson_id, task, answer_right)
+            VALUES (:user_id, :lesson_id, :task, :answer_right)
+            RETURNING id
+        """),
+        {"user_id": job.user_id, "lesson_id": job.lesson_id, "task": task, "answer_right": answer_right}
+    )).scalar()
+
+    updated = (await db.execute(
+        text("""
+            UPDATE jobs SET status = 'done', task_id = :task_id, error = NULL, updated_at = NOW()
+            WHERE id = :job_id AND status = 'running'
+        """),
+        {"task_id": task_id, "job_id": job.id}
+    )).rowcount
+
+    if not updated:
+        await db.rollback()
+        return False
+
+    await db.commit()
+    return True
+
+# Генерация задачи по уроку: готовая задача из пула или запрос к нейросети.
+# Соединение с БД не удерживается во время запроса к нейросети
+async def _run_generate_task(job):
+    async with db_session() as db:
+        lesson = (await db.execute(
+            text("SELECT id, title, description, education_content FROM lessons WHERE id = :lesson_id"),
+            {"lesson_id": job.lesson_id}
+        )).fetchone()
+
+        if not lesson:
+            raise ValueError("Урок не найден")
+
+        pooled_task = await task_pool.claim_task(db, lesson.id)
+        if pooled_task:
+            await _complete_generate_task(db, job, pooled_task.task, pooled_task.answer_right)
+            return
+
+    task_pool.request_refill(lesson.id)
+    task, answer_right = task_pool.parse_task_response(await ai.chat(task_pool.build_task_prompt(lesson)))
+
+    async with db_session() as db:
+        await _complete_generate_task(db, job, task, answer_right)
+
+JOB_HANDLERS = {
+    "generate_task": _run_generate_task,
+}
+
+# Ошибка задания: повтор с нарастающей задержкой или окончательный отказ после JOB_MAX_ATTEMPTS попыток
+async def _fail_job(job, error: str):
+    final = job.attempts >= JOB_MAX_ATTEMPTS
+    async with db_session() as db:
+        await db.execute(
+            text("""
+                UPDATE jobs
+                SET status = :status, error = :error, updated_at = NOW(),
+                    run_after = NOW() + make_interval(secs => :delay)
+                WHERE id = :job_id AND status = 'running'
+            """),
+            {
+                "status": "failed" if final else "queued",
+                "error": error,
+                "delay": JOB_RETRY_DELAY_SECONDS * job.attempts,
+                "job_id": job.id
+            }
+        )
+        await db.commit()
+
+    metrics.inc("jobs_failed_total" if final else "jobs_retried_total")
+
+async def _run_job(job):
+    started = time.perf_counter()
+    _running_job_ids.add(job.id)
+    try:
+        await JOB_HANDLERS[job.kind](job)
+        metrics.inc("jobs_done_total")
+    except Exception as e:
+        await _fail_job(job, str(getattr(e, "detail", e)) or e.__class__.__name__)
+    finally:
+        _running_job_ids.discard(job.id)
+        metrics.observe(f"job_{job.kind}_seconds", time.perf_counter() - started)
+
+async def _worker_loop():
+    while True:
+        try:
+            job = await claim_job()
+        except Exception as e:
+            print(f"Ошибка получения задания: {str(e)}")
+            job = None
+
+        if job is not None:
+            # Ошибка при сохранении результата (например, недоступна БД) не должна останавливать обработчик;
+            # задание вернётся в очередь через recover_stale_jobs
+            try:
+                await _run_job(job)
+            except Exception as e:
+                error = getattr(e, "detail", e)
+                print(f"Ошибка выполнения задания {job.id}: {str(error)}")
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), JOB_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+async def _recovery_loop():
+    while True:
+        try:
+            await recover_stale_jobs()
+        except Exception as e:
+            print(f"Ошибка восстановления заданий: {str(e)}")
+        await asyncio.sleep(JOB_STALE_SECONDS / 2)
+
+# Запуск обработчиков заданий (в lifespan приложения)
+def start_job_workers():
+    global _wakeup
+    if _workers:
+        return
+
+    _wakeup = asyncio.Event()
+    _workers.append(asyncio.create_task(_recovery_loop()))
+    for _ in range(JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker_loop()))
+
+# Остановка обработчиков; прерванные задания этого процесса сразу возвращаются в очередь
+async def stop_job_workers():
+    global _wakeup
+    interrupted = list(_running_job_ids)
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _wakeup = None
+
+    if interrupted:
+        async with db_session() as db:
+            await db.execute(
+                text("""
+                    UPDATE jobs SET status = 'queued', attempts = attempts - 1, updated_at = NOW()
+                    WHERE id = ANY(CAST(:job_ids AS INTEGER[])) AND status = 'running'
+                """),
+                {"job_ids": interrupted}
+            )
+            await db.commit()
+
+def _jobs_status() -> dict:
+    return {"workers": JOB_WORKERS if _workers else 0, "running": len(_running_job_ids)}
+
+metrics.register_gauge("jobs", _jobs_status)
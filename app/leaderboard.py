@@ -0,0 +1,114 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from app import metrics
+from app.cache import TTLCache
+from app.database import db_session
+
+load_dotenv()
+
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", 60))
+LEADERBOARD_TOP_SIZE = int(os.getenv("LEADERBOARD_TOP_SIZE", 100))
+LEADERBOARD_CACHE_MAX_SIZE = int(os.getenv("LEADERBOARD_CACHE_MAX_SIZE", 1000))
+
+LEADERBOARD_METRICS = ("lesson_complete", "course_complete", "max_streak")
+
+# Ключ advisory-блокировки: представления обновляет только один процесс одновременно
+LEADERBOARD_LOCK_KEY = 2401
+
+# Первые LEADERBOARD_TOP_SIZE мест: (course_id или None, показатель) -> список участников.
+# Кэш живёт не дольше интервала обновления представлений
+_top = TTLCache(maxsize=LEADERBOARD_CACHE_MAX_SIZE, ttl=LEADERBOARD_REFRESH_SECONDS)
+_worker = None
+
+def _entry(row, metric: str) -> dict:
+    return {
+        "rank": getattr(row, f"{metric}_rank"),
+        "user_id": row.user_id,
+        "firstname": row.firstname,
+        "surname": row.surname,
+        "value": getattr(row, metric)
+    }
+
+# Пересчёт рейтингов. Чтение представлений во время обновления не блокируется
+async def refresh_leaderboards() -> bool:
+    async with db_session() as db:
+        locked = (await db.execute(
+            text("SELECT pg_try_advisory_xact_lock(:lock_key)"),
+            {"lock_key": LEADERBOARD_LOCK_KEY}
+        )).scalar()
+
+        if not locked:
+            return False
+
+        await db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY leaderboard_global"))
+        await db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY leaderboard_course"))
+        await db.commit()
+
+    _top.clear()
+    metrics.inc("leaderboard_refreshes_total")
+    return True
+
+# Первые limit мест по показателю (глобально или в курсе) из кэша первых LEADERBOARD_TOP_SIZE мест
+async def get_top(db, metric: str, limit: int, course_id: int = None) -> list:
+    top = _top.get((course_id, metric))
+    if top is None:
+        metrics.inc("leaderboard_cache_misses_total")
+        if course_id is None:
+            query = f"""
+                SELECT * FROM leaderboard_global
+                ORDER BY {metric}_rank, user_id
+                LIMIT :limit
+            """
+        else:
+            query = f"""
+                SELECT * FROM leaderboard_course
+                WHERE course_id = :course_id
+                ORDER BY {metric}_rank, user_id
+                LIMIT :limit
+            """
+        rows = (await db.execute(text(query), {"course_id": course_id, "limit": LEADERBOARD_TOP_SIZE})).fetchall()
+        top = [_entry(row, metric) for row in rows]
+        _top.set((course_id, metric), top)
+
+    return top[:limit]
+
+# Место пользователя по показателю: поиск по уникальному индексу, без подсчёта обгоняющих
+async def get_rank(db, metric: str, user_id: int, course_id: int = None):
+    if course_id is None:
+        row = (await db.execute(
+            text("SELECT * FROM leaderboard_global WHERE user_id = :user_id"),
+            {"user_id": user_id}
+        )).fetchone()
+    else:
+        row = (await db.execute(
+            text("SELECT * FROM leaderboard_course WHERE course_id = :course_id AND user_id = :user_id"),
+            {"course_id": course_id, "user_id": user_id}
+        )).fetchone()
+
+    return _entry(row, metric) if row else None
+
+async def _refresh_loop():
+    while True:
+        try:
+            await refresh_leaderboards()
+        except Exception as e:
+            print(f"Ошибка обновления рейтингов: {str(e)}")
+        await asyncio.sleep(LEADERBOARD_REFRESH_SECONDS)
+
+# Запуск периодического обновления рейтингов (в lifespan приложения)
+def start_leaderboard_worker():
+    global _worker
+    if _worker is None:
+        _worker = asyncio.create_task(_refresh_loop())
+
+async def stop_leaderboard_worker():
+    global _worker
+    if _worker is None:
+        return
+
+    _worker.cancel()
+    await asyncio.gather(_worker, return_exceptions=True)
+    _worker = None
@@ -0,0 +1,40 @@
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+_gauges = {}
+
+# Увеличение счётчика
+def inc(name: str, value: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+# Учёт длительности операции в секундах (количество, сумма, максимум)
+def observe(name: str, seconds: float):
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+
+# Регистрация показателя, значение которого вычисляется в момент чтения метрик
+def register_gauge(name: str, func):
+    with _lock:
+        _gauges[name] = func
+
+# Снимок всех метрик процесса
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            name: {**timing, "avg": timing["total"] / timing["count"] if timing["count"] else 0.0}
+            for name, timing in _timings.items()
+        }
+        gauges = dict(_gauges)
+
+    return {
+        "counters": counters,
+        "timings": timings,
+        "gauges": {name: func() for name, func in gauges.items()},
+    }
@@ -0,0 +1,125 @@
+import os
+import re
+import sys
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+load_dotenv()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db", "migrations")
+MIGRATIONS_LOCK_ID = 7_306_001
+
+# Миграции с этой пометкой выполняются вне транзакции (нужно для CREATE INDEX CONCURRENTLY)
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+# Разбиение SQL-файла на отдельные запросы (точка с запятой внутри $$ ... $$ не считается разделителем)
+def split_statements(sql: str) -> list:
+    statements = []
+    current = []
+    in_dollar_quote = False
+
+    for line in sql.splitlines():
+        if not in_dollar_quote and (not line.strip() or line.strip().startswith("--")):
+            continue
+
+        current.append(line)
+        if line.count("$$") % 2 == 1:
+            in_dollar_quote = not in_dollar_quote
+
+        if not in_dollar_quote and line.rstrip().endswith(";"):
+            statements.append("\n".join(current).rstrip().rstrip(";"))
+            current = []
+
+    if "".join(current).strip():
+        statements.append("\n".join(current))
+
+    return statements
+
+# Список миграций в порядке версий: [(version, path)]
+def list_migrations() -> list:
+    migrations = []
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if name.endswith(".sql"):
+            migrations.append((name[:-len(".sql")], os.path.join(MIGRATIONS_DIR, name)))
+    return migrations
+
+# Удаление индексов, оставшихся невалидными после прерванного CREATE INDEX CONCURRENTLY
+def drop_invalid_indexes(connection, sql: str):
+    names = re.findall(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", sql, re.IGNORECASE)
+    if not names:
+        return
+
+    invalid = connection.execute(
+        text("""
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE NOT i.indisvalid AND c.relname = ANY(:names)
+        """),
+        {"names": names}
+    ).fetchall()
+
+    for index in invalid:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.relname}"'))
+
+# Применение одной миграции
+def apply_migration(engine, version: str, sql: str):
+    with engine.connect() as connection:
+        if NO_TRANSACTION_MARKER in sql:
+            connection.execution_options(isolation_level="AUTOCOMMIT")
+            drop_invalid_indexes(connection, sql)
+            for statement in split_statements(sql):
+                connection.execute(text(statement))
+            connection.execute(
+                text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                {"version": version}
+            )
+        else:
+            with connection.begin():
+                for statement in split_statements(sql):
+                    connection.execute(text(statement))
+                connection.execute(
+                    text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                    {"version": version}
+                )
+
+# Применение всех ещё не применённых миграций.
+# Advisory lock не даёт нескольким процессам приложения применять миграции одновременно
+def run_migrations(database_url: str = None) -> list:
+    engine = create_engine(database_url or os.getenv("DATABASE_URL"))
+    applied_now = []
+
+    try:
+        with engine.connect() as lock_connection:
+            lock_connection.execution_options(isolation_level="AUTOCOMMIT")
+            lock_connection.execute(text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": MIGRATIONS_LOCK_ID})
+            try:
+                lock_connection.execute(text("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version VARCHAR(255) PRIMARY KEY,
+                        applied_at TIMESTAMPTZ DEFAULT NOW()
+                    )
+                """))
+
+                applied = {
+                    row.version for row in lock_connection.execute(text("SELECT version FROM schema_migrations")).fetchall()
+                }
+
+                for version, path in list_migrations():
+                    if version in applied:
+                        continue
+
+                    with open(path, encoding="utf-8") as f:
+                        apply_migration(engine, version, f.read())
+
+                    applied_now.append(version)
+                    print(f"Миграция {version} применена")
+            finally:
+                lock_connection.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": MIGRATIONS_LOCK_ID})
+    finally:
+        engine.dispose()
+
+    return applied_now
+
+if __name__ == "__main__":
+    run_migrations(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
 from datetime import date
 
 # User
@@ -20,6 +20,10 @@ class EmailTokenRequest(BaseModel):
     token: Optional[str] = None
     email: EmailStr
 
+class BulkEmailTokenRequest(BaseModel):
+    token: str
+    emails: List[EmailStr]
+
 class VerifyRequest(BaseModel):
     code: str
     email: EmailStr
@@ -64,4 +68,12 @@ class AskLessonRequest(BaseModel):
 # Task
 class CheckTaskRequest(BaseModel):
     token: str
-    answer: str
\ No newline at end of file
+    answer: str
+
+class TaskAnswer(BaseModel):
+    task_id: int
+    answer: str
+
+class BatchCheckTaskRequest(BaseModel):
+    token: str
+    answers: List[TaskAnswer]
\ No newline at end of file
@@ -0,0 +1,174 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+import math
+import multiprocessing
+import os
+import time
+import bcrypt
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from app import metrics
+
+load_dotenv()
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64))
+PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS", 5))
+PASSWORD_HASH_TARGET_MS = float(os.getenv("PASSWORD_HASH_TARGET_MS", 250))
+# Нижняя граница стоимости - значение bcrypt.gensalt() по умолчанию: калибровка может только повысить стоимость
+PASSWORD_HASH_MIN_ROUNDS = int(os.getenv("PASSWORD_HASH_MIN_ROUNDS", 12))
+PASSWORD_HASH_MAX_ROUNDS = int(os.getenv("PASSWORD_HASH_MAX_ROUNDS", 14))
+# Явно заданная стоимость отключает калибровку при запуске
+PASSWORD_HASH_ROUNDS = os.getenv("PASSWORD_HASH_ROUNDS")
+
+_rounds = int(PASSWORD_HASH_ROUNDS) if PASSWORD_HASH_ROUNDS else 12
+_executor = None
+_semaphore = None
+_active = 0
+_waiting = 0
+
+# Функции, выполняемые в процессах пула
+def _hash(text: str, rounds: int) -> str:
+    return bcrypt.hashpw(text.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+def _verify(plain_text: str, hashed_text: str) -> bool:
+    return bcrypt.checkpw(plain_text.encode("utf-8"), hashed_text.encode("utf-8"))
+
+def _measure(rounds: int) -> float:
+    started = time.perf_counter()
+    _hash("calibration", rounds)
+    return time.perf_counter() - started
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+# Замена пула, ставшего непригодным после аварийного завершения процесса (OOM, segfault)
+def _reset_executor(broken: ProcessPoolExecutor):
+    global _executor
+    if _executor is broken:
+        _executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+        metrics.inc("password_hash_pool_restarts_total")
+
+def _reject(reason: str):
+    metrics.inc(f"password_hash_rejected_{reason}_total")
+    raise HTTPException(status_code=503, detail="Сервер перегружен, повторите запрос позже")
+
+# Ограничение очереди к пулу: запросов в работе не больше числа процессов,
+# ожидающих не больше PASSWORD_HASH_MAX_QUEUE, ожидание не дольше PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS
+@asynccontextmanager
+async def _slot():
+    global _active, _waiting, _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+    semaphore = _semaphore
+
+    if semaphore.locked():
+        if _waiting >= PASSWORD_HASH_MAX_QUEUE:
+            _reject("queue")
+
+        _waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            _reject("timeout")
+        finally:
+            _waiting -= 1
+        metrics.observe("password_hash_queue_wait_seconds", time.perf_counter() - started)
+    else:
+        await semaphore.acquire()
+
+    _active += 1
+    try:
+        yield
+    finally:
+        _active -= 1
+        semaphore.release()
+
+# Выполнение в пуле процессов; если пул сломан (процесс пула аварийно завершился), он пересоздаётся
+# и вызов повторяется один раз, чтобы вход и регистрация не отвечали ошибкой до перезапуска приложения
+async def _run(kind: str, func, *args):
+    async with _slot():
+        started = time.perf_counter()
+        executor = _get_executor()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            _reset_executor(executor)
+            result = await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+        metrics.observe(f"password_{kind}_seconds", time.perf_counter() - started)
+        return result
+
+# Хэширование пароля или кода подтверждения с текущей стоимостью bcrypt
+async def hash_password(text: str) -> str:
+    return await _run("hash", _hash, text, _rounds)
+
+async def verify_password(plain_text: str, hashed_text: str) -> bool:
+    return await _run("verify", _verify, plain_text, hashed_text)
+
+# Хэш создан с меньшей стоимостью, чем текущая: его стоит пересчитать при успешном входе
+def needs_rehash(hashed_text: str) -> bool:
+    try:
+        return int(hashed_text.split("$")[2]) < _rounds
+    except (IndexError, ValueError):
+        return False
+
+# Новый хэш пароля с текущей стоимостью для хэша, созданного с меньшей (при успешном входе).
+# При перегрузке пула пересчёт откладывается до следующего входа, а не прерывает вход
+async def rehash_if_needed(plain_text: str, hashed_text: str):
+    if not needs_rehash(hashed_text):
+        return None
+
+    try:
+        return await hash_password(plain_text)
+    except HTTPException:
+        return None
+
+# Выбор стоимости bcrypt: время хэширования удваивается с каждым раундом,
+# поэтому по одному замеру выбирается наибольшая стоимость, укладывающаяся в PASSWORD_HASH_TARGET_MS
+async def calibrate() -> int:
+    global _rounds
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+
+    # Первый замер прогревает процесс пула и не учитывается
+    await loop.run_in_executor(executor, _measure, PASSWORD_HASH_MIN_ROUNDS)
+    elapsed = await loop.run_in_executor(executor, _measure, PASSWORD_HASH_MIN_ROUNDS)
+
+    extra_rounds = math.floor(math.log2(PASSWORD_HASH_TARGET_MS / 1000 / elapsed)) if elapsed > 0 else 0
+    _rounds = max(PASSWORD_HASH_MIN_ROUNDS, min(PASSWORD_HASH_MAX_ROUNDS, PASSWORD_HASH_MIN_ROUNDS + extra_rounds))
+    return _rounds
+
+# Запуск пула процессов и калибровка стоимости (в lifespan приложения); выбранная стоимость видна в метриках passwords
+async def start_password_pool():
+    _get_executor()
+    if not PASSWORD_HASH_ROUNDS:
+        await calibrate()
+
+def stop_password_pool():
+    global _executor, _semaphore
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _semaphore = None
+
+def _passwords_status() -> dict:
+    return {
+        "rounds": _rounds,
+        "workers": PASSWORD_HASH_WORKERS,
+        "active": _active,
+        "waiting": _waiting,
+        "max_queue": PASSWORD_HASH_MAX_QUEUE
+    }
+
+metrics.register_gauge("passwords", _passwords_status)
@@ -0,0 +1,129 @@
+from collections import Counter
+import hashlib
+import math
+import os
+import re
+from dotenv import load_dotenv
+
+from app import metrics
+from app.cache import TTLCache
+
+load_dotenv()
+
+RETRIEVAL_CONTEXT_CHARS = int(os.getenv("RETRIEVAL_CONTEXT_CHARS", 4000))
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", 800))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 4))
+RETRIEVAL_MAX_LESSONS = int(os.getenv("RETRIEVAL_MAX_LESSONS", 1000))
+
+# Длина основы слова: грубый стемминг, чтобы разные формы слова ("цифра", "цифры", "цифрами") совпадали
+STEM_LENGTH = 6
+STOP_WORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "к", "ко", "о", "об", "от", "до", "из", "за", "для", "не", "ни", "но",
+    "а", "или", "что", "как", "это", "то", "так", "же", "ли", "бы", "у", "при", "чем", "где", "когда", "если",
+    "the", "a", "an", "of", "to", "in", "and", "or", "is", "are",
+}
+
+# Индексы уроков в памяти процесса: lesson_id -> (хэш содержимого, индекс)
+_indexes = TTLCache(maxsize=RETRIEVAL_MAX_LESSONS, ttl=24 * 3600)
+
+def tokenize(text: str) -> list:
+    words = re.findall(r"\w+", text.lower().replace("ё", "е"))
+    return [word[:STEM_LENGTH] for word in words if word not in STOP_WORDS]
+
+# Разбиение содержимого урока на фрагменты до RETRIEVAL_CHUNK_CHARS символов по абзацам и предложениям
+def split_chunks(content: str, chunk_chars: int = RETRIEVAL_CHUNK_CHARS) -> list:
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_chars:
+            pieces.append(paragraph)
+            continue
+
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            while len(sentence) > chunk_chars:
+                pieces.append(sentence[:chunk_chars])
+                sentence = sentence[chunk_chars:]
+            if sentence:
+                pieces.append(sentence)
+
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + len(piece) + 1 <= chunk_chars:
+            chunks[-1] = f"{chunks[-1]}\n{piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+# Индекс BM25 по фрагментам одного урока
+class BM25Index:
+    def __init__(self, chunks: list, k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self._terms = [Counter(tokenize(chunk)) for chunk in chunks]
+        self._lengths = [sum(terms.values()) for terms in self._terms]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if chunks else 0.0
+
+        document_frequency = Counter()
+        for terms in self._terms:
+            document_frequency.update(terms.keys())
+        self._idf = {
+            term: math.log(1 + (len(chunks) - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def score(self, query_terms: list, index: int) -> float:
+        terms = self._terms[index]
+        length_norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / (self._avg_length or 1))
+        return sum(
+            self._idf[term] * terms[term] * (self.k1 + 1) / (terms[term] + length_norm)
+            for term in query_terms if term in terms
+        )
+
+    # Номера k наиболее подходящих к запросу фрагментов, по убыванию релевантности
+    def search(self, query: str, k: int) -> list:
+        query_terms = list(set(tokenize(query)))
+        scores = [(self.score(query_terms, index), index) for index in range(len(self.chunks))]
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return [index for score, index in scores[:k]]
+
+def _content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+# Построение индекса урока (при создании и изменении урока, а также при первом обращении в процессе)
+def index_lesson(lesson_id: int, content: str) -> BM25Index:
+    index = BM25Index(split_chunks(content or ""))
+    _indexes.set(lesson_id, (_content_hash(content or ""), index))
+    metrics.inc("retrieval_indexed_total")
+    return index
+
+def get_index(lesson_id: int, content: str) -> BM25Index:
+    cached = _indexes.get(lesson_id)
+    if cached is not None and cached[0] == _content_hash(content or ""):
+        return cached[1]
+    return index_lesson(lesson_id, content)
+
+def forget_lesson(lesson_id: int):
+    _indexes.pop(lesson_id)
+
+# Контекст урока для промпта: содержимое целиком, если укладывается в RETRIEVAL_CONTEXT_CHARS,
+# иначе - наиболее подходящие к запросу фрагменты в порядке следования в уроке
+def build_context(lesson, query: str) -> str:
+    content = lesson.education_content or ""
+    if len(content) <= RETRIEVAL_CONTEXT_CHARS:
+        return content
+
+    index = get_index(lesson.id, content)
+    selected = []
+    used = 0
+    for chunk_index in index.search(query, RETRIEVAL_TOP_K):
+        chunk_length = len(index.chunks[chunk_index])
+        if selected and used + chunk_length > RETRIEVAL_CONTEXT_CHARS:
+            continue
+        selected.append(chunk_index)
+        used += chunk_length
+
+    metrics.inc("retrieval_trimmed_prompts_total")
+    return "\n...\n".join(index.chunks[chunk_index][:RETRIEVAL_CONTEXT_CHARS] for chunk_index in sorted(selected))
@@ -1,33 +1,66 @@
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import bisect
+from dataclasses import dataclass
+import json
 import os
+import time
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 
+from app.database import db_session, get_db
 from app.models import CreateCourseRequest, TokenRequest, UpdateCourseRequest
-from app.utils import get_user_by_token, is_admin, check_token_expiry, is_user_in_course
+from app.utils import LESSON_FIELDS, LESSON_SUMMARY_FIELDS, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, decode_cursor, etag_matches, get_user_by_token, is_admin, check_token_expiry, is_user_in_course, make_etag, parse_fields, split_page
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+COURSE_CATALOG_TTL_SECONDS = float(os.getenv("COURSE_CATALOG_TTL_SECONDS", 60))
 
 course_router = APIRouter(prefix="/api/course", tags=["Course API"])
 
-# Получение всех курсов
-@course_router.get("")
-def get_courses():
-    db = SessionLocal()
-    try:
-        courses = db.execute(
-            text("SELECT id, title, description, price FROM courses")
-        ).fetchall()
-        
-        if not courses:
-            raise HTTPException(status_code=404, detail="Курсы не найдены")
-        
+# Каталог курсов в памяти процесса: список курсов и уже сериализованные страницы ответа с ETag.
+# Версия увеличивается при создании/изменении/удалении курса, TTL ограничивает устаревание между процессами
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    courses: list
+    ids: list
+    pages: dict
+    expires_at: float
+
+CATALOG_MAX_CACHED_PAGES = 256
+
+_catalog_version = 0
+_catalog_snapshot = None
+_catalog_lock = asyncio.Lock()
+
+# Сброс каталога курсов после изменений
+def invalidate_course_catalog():
+    global _catalog_version, _catalog_snapshot
+    _catalog_version += 1
+    _catalog_snapshot = None
+
+def _is_fresh(snapshot) -> bool:
+    return snapshot is not None and snapshot.version == _catalog_version and snapshot.expires_at > time.monotonic()
+
+# Получение снимка каталога курсов (из БД только при отсутствии актуального снимка)
+async def get_course_catalog() -> CatalogSnapshot:
+    global _catalog_snapshot
+    if _is_fresh(_catalog_snapshot):
+        return _catalog_snapshot
+
+    async with _catalog_lock:
+        if _is_fresh(_catalog_snapshot):
+            return _catalog_snapshot
+
+        version = _catalog_version
+        async with db_session() as db:
+            courses = (await db.execute(
+                text("SELECT id, title, description, price FROM courses ORDER BY id")
+            )).fetchall()
+
         courses_list = []
         for course in courses:
             courses_list.append({
@@ -36,94 +69,129 @@ def get_courses():
                 "description": course.description,
                 "price": course.price if course.price else 0
             })
-        
-        return {
-            "status": "success",
-            "count_courses": len(courses_list),
-            "courses": courses_list
-        }
-        
+
+        snapshot = CatalogSnapshot(
+            version=version,
+            courses=courses_list,
+            ids=[course["id"] for course in courses_list],
+            pages={},
+            expires_at=time.monotonic() + COURSE_CATALOG_TTL_SECONDS,
+        )
+        if version == _catalog_version:
+            _catalog_snapshot = snapshot
+        return snapshot
+
+# Страница каталога после курса after_id: (тело ответа, ETag), сериализуется один раз на снимок
+def get_catalog_page(catalog: CatalogSnapshot, after_id: int, limit: int) -> tuple:
+    page = catalog.pages.get((after_id, limit))
+    if page is not None:
+        return page
+
+    start = bisect.bisect_right(catalog.ids, after_id)
+    courses_list, next_cursor = split_page(catalog.courses[start:start + limit + 1], limit, lambda course: (course["id"],))
+
+    body = json.dumps({
+        "status": "success",
+        "count_courses": len(courses_list),
+        "courses": courses_list,
+        "next_cursor": next_cursor
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    if len(catalog.pages) >= CATALOG_MAX_CACHED_PAGES:
+        catalog.pages.clear()
+    page = catalog.pages[(after_id, limit)] = (body, make_etag(body))
+    return page
+
+# Получение всех курсов
+@course_router.get("")
+async def get_courses(
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    if_none_match: Optional[str] = Header(None),
+):
+    after_id = decode_cursor(cursor, int)[0] if cursor else 0
+
+    try:
+        catalog = await get_course_catalog()
     except HTTPException:
-        db.rollback()
         raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
+
+    if not catalog.courses:
+        raise HTTPException(status_code=404, detail="Курсы не найдены")
+
+    body, etag = get_catalog_page(catalog, after_id, limit)
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # Получение уроков в определенном курсе
 @course_router.post("/{course_id}/lessons")
-def get_lessons_by_course(course_id: int, request: TokenRequest):
-    db = SessionLocal()
+async def get_lessons_by_course(
+    course_id: int,
+    request: TokenRequest,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_db),
+):
     full_access = False
+    columns = parse_fields(fields, LESSON_FIELDS, LESSON_SUMMARY_FIELDS)
+    after_id = decode_cursor(cursor, int)[0] if cursor else 0
     try:
         if (request.token != None):
-            check_token_expiry(db, request.token)
-            if is_admin(db, request.token) or is_user_in_course(db, request.token, course_id):
+            await check_token_expiry(db, request.token)
+            if await is_admin(db, request.token) or await is_user_in_course(db, request.token, course_id):
                 full_access = True
-            
-        lessons = db.execute(
-            text("""
-                SELECT id, title, description, education_content, course_id, duration_minutes 
-                FROM lessons 
-                WHERE course_id = :course_id 
-            """),
-            {"course_id": course_id}
-        ).fetchall()
-        
-        if full_access == True:
-            lessons_list = [
-                {
-                    "id": lesson.id,
-                    "title": lesson.title,
-                    "description": lesson.description,
-                    "education_content": lesson.education_content,
-                    "course_id": lesson.course_id,
-                    "duration_minutes": lesson.duration_minutes
-                }
-                for lesson in lessons
-            ]
-        
-        else:
-            lessons_list = [
-                {
-                    "id": lesson.id,
-                    "title": lesson.title,
-                    "description": lesson.description,
-                    "course_id": lesson.course_id,
-                    "duration_minutes": lesson.duration_minutes
-                }
-                for lesson in lessons
-            ]
+
+        # Содержимое уроков доступно только администратору и слушателям курса
+        if not full_access and "education_content" in columns:
+            columns.remove("education_content")
+
+        query = f"""
+            SELECT {', '.join(columns)}
+            FROM lessons 
+            WHERE course_id = :course_id AND id > :after_id
+            ORDER BY id
+            LIMIT :limit
+        """
+        lessons = (await db.execute(
+            text(query),
+            {"course_id": course_id, "after_id": after_id, "limit": limit + 1}
+        )).fetchall()
+        lessons, next_cursor = split_page(lessons, limit, lambda lesson: (lesson.id,))
+
+        lessons_list = [dict(lesson._mapping) for lesson in lessons]
         return {
             "status": "success",
             "course_id": course_id,
             "count_lessons": len(lessons_list),
-            "lessons": lessons_list
+            "lessons": lessons_list,
+            "next_cursor": next_cursor
         }
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Создание нового курса
 @course_router.post("/create")
-def create_course(request: CreateCourseRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def create_course(request: CreateCourseRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Ошибка доступа"
         )
     try:
-        db.execute(
+        await db.execute(
             text("""
                 INSERT INTO courses (title, description, price) 
                 VALUES (:title, :description, :price)
@@ -134,33 +202,31 @@ def create_course(request: CreateCourseRequest):
                 "price": request.price,
             }
         )
-        db.commit()
+        await db.commit()
+        invalidate_course_catalog()
         return {"status": "success", "message": "Курс создан"}
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Внесение изменений в курс
 @course_router.put("/update/{course_id}")
-def update_course(course_id: int, request: UpdateCourseRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def update_course(course_id: int, request: UpdateCourseRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Ошибка доступа"
         )
     try:
-        course = db.execute(
+        course = (await db.execute(
             text("SELECT id FROM courses WHERE id = :course_id"),
             {"course_id": course_id}
-        ).fetchone()
+        )).fetchone()
 
         if not course:
             raise HTTPException(status_code=404, detail="Курс не найден")
@@ -187,50 +253,47 @@ def update_course(course_id: int, request: UpdateCourseRequest):
             params["price"] = request.price
         
         query = f"UPDATE courses SET {', '.join(update_fields)} WHERE id = :course_id"
-        db.execute(text(query), params)
+        await db.execute(text(query), params)
         
-        db.commit()
+        await db.commit()
+        invalidate_course_catalog()
         return {"status": "success", "message": "Курс обновлен"}
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
     
 # Удаление курса
 @course_router.delete("/delete/{course_id}")
-def delete_course(course_id: int, request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def delete_course(course_id: int, request: TokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(status_code=403, detail="Ошибка доступа")
     
     try:
-        course = db.execute(
+        course = (await db.execute(
             text("SELECT id FROM courses WHERE id = :course_id"),
             {"course_id": course_id}
-        ).fetchone()
+        )).fetchone()
 
         if not course:
             raise HTTPException(status_code=404, detail="Курс не найден")
         
-        db.execute(
+        await db.execute(
             text("DELETE FROM courses WHERE id = :course_id"),
             {"course_id": course_id}
         )
         
-        db.commit()
+        await db.commit()
+        invalidate_course_catalog()
         return {"status": "success", "message": "Курс и все связные уроки удалены"}
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
\ No newline at end of file
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import time
+from fastapi import APIRouter, HTTPException, Query
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+from app.database import db_session
+from app.models import TokenRequest
+from app.utils import check_token_expiry, get_user_by_token
+
+load_dotenv()
+
+JOB_LONG_POLL_MAX_SECONDS = float(os.getenv("JOB_LONG_POLL_MAX_SECONDS", 30))
+JOB_LONG_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_LONG_POLL_INTERVAL_SECONDS", 0.5))
+
+job_router = APIRouter(prefix="/api/job", tags=["Job API"])
+
+# Статус задания. С параметром wait ответ ждёт завершения задания до wait секунд (long polling);
+# соединение с БД берётся только на время каждой проверки
+@job_router.post("/{job_id}")
+async def get_job(job_id: int, request: TokenRequest, wait: float = Query(0, ge=0, le=JOB_LONG_POLL_MAX_SECONDS)):
+    async with db_session() as db:
+        await check_token_expiry(db, request.token)
+        user_id = await get_user_by_token(db, request.token)
+
+    deadline = time.monotonic() + wait
+    while True:
+        async with db_session() as db:
+            job = (await db.execute(
+                text("""
+                    SELECT j.id, j.kind, j.lesson_id, j.status, j.attempts, j.error, j.task_id, t.task
+                    FROM jobs j
+                    LEFT JOIN tasks t ON t.id = j.task_id
+                    WHERE j.id = :job_id AND j.user_id = :user_id
+                """),
+                {"job_id": job_id, "user_id": user_id}
+            )).fetchone()
+
+        if not job:
+            raise HTTPException(status_code=404, detail="Задание не найдено")
+
+        remaining = deadline - time.monotonic()
+        if job.status in ("done", "failed") or remaining <= 0:
+            break
+        await asyncio.sleep(min(JOB_LONG_POLL_INTERVAL_SECONDS, remaining))
+
+    result = {
+        "status": "success",
+        "job_id": job.id,
+        "kind": job.kind,
+        "lesson_id": job.lesson_id,
+        "job_status": job.status,
+        "attempts": job.attempts
+    }
+
+    if job.status == "done":
+        result["task_id"] = job.task_id
+        result["task"] = job.task
+    elif job.error:
+        result["error"] = job.error
+
+    return result
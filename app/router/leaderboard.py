@@ -0,0 +1,70 @@
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import leaderboard
+from app.database import get_db
+from app.models import TokenRequest
+from app.utils import check_token_expiry, get_user_by_token, is_admin, is_user_in_course
+
+leaderboard_router = APIRouter(prefix="/api/leaderboard", tags=["Leaderboard API"])
+
+Metric = Literal["lesson_complete", "course_complete", "max_streak"]
+
+# Проверка доступа к рейтингу курса: участники курса и администраторы
+async def check_course_access(db, token: str, course_id: int):
+    if not await is_user_in_course(db, token, course_id) and not await is_admin(db, token):
+        raise HTTPException(status_code=403, detail="Ошибка доступа")
+
+# Первые места общего рейтинга
+@leaderboard_router.post("")
+async def get_leaderboard(
+    request: TokenRequest,
+    metric: Metric = "lesson_complete",
+    limit: int = Query(10, ge=1, le=leaderboard.LEADERBOARD_TOP_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    await check_token_expiry(db, request.token)
+
+    leaders = await leaderboard.get_top(db, metric, limit)
+    return {"status": "success", "metric": metric, "leaders": leaders}
+
+# Место пользователя в общем рейтинге
+@leaderboard_router.post("/rank")
+async def get_leaderboard_rank(request: TokenRequest, metric: Metric = "lesson_complete", db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    user_id = await get_user_by_token(db, request.token)
+
+    rank = await leaderboard.get_rank(db, metric, user_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="Пользователь отсутствует в рейтинге")
+
+    return {"status": "success", "metric": metric, **rank}
+
+# Первые места рейтинга курса
+@leaderboard_router.post("/course/{course_id}")
+async def get_course_leaderboard(
+    course_id: int,
+    request: TokenRequest,
+    metric: Metric = "lesson_complete",
+    limit: int = Query(10, ge=1, le=leaderboard.LEADERBOARD_TOP_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    await check_token_expiry(db, request.token)
+    await check_course_access(db, request.token, course_id)
+
+    leaders = await leaderboard.get_top(db, metric, limit, course_id)
+    return {"status": "success", "course_id": course_id, "metric": metric, "leaders": leaders}
+
+# Место пользователя в рейтинге курса
+@leaderboard_router.post("/course/{course_id}/rank")
+async def get_course_leaderboard_rank(course_id: int, request: TokenRequest, metric: Metric = "lesson_complete", db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    await check_course_access(db, request.token, course_id)
+    user_id = await get_user_by_token(db, request.token)
+
+    rank = await leaderboard.get_rank(db, metric, user_id, course_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="Пользователь отсутствует в рейтинге")
+
+    return {"status": "success", "course_id": course_id, "metric": metric, **rank}
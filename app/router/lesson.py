@@ -1,90 +1,165 @@
-import re
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-import os
+from datetime import timezone
+from email.utils import format_datetime
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 
+from app import achievements, ai, answer_cache, jobs, retrieval, task_pool
+from app.database import db_session, get_db
 from app.models import AskLessonRequest, CreateLessonRequest, TokenRequest, UpdateLessonRequest
-from app.utils import check_token_expiry, get_course_by_lesson, get_user_by_token, hash_token, is_admin, is_existing_token, is_user_in_course, process_achievement_event, query_ai
+from app.utils import LESSON_FIELDS, LESSON_SUMMARY_FIELDS, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, check_token_expiry, decode_cursor, etag_matches, get_course_by_lesson, get_user_by_token, hash_token, is_admin, is_existing_token, is_not_modified_since, is_user_in_course, make_etag, parse_fields, query_ai, split_page
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
 lesson_router = APIRouter(prefix="/api/lesson", tags=["Lesson API"])
 
 # Получение всех уроков
 @lesson_router.post("")
-def get_lessons(request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
+async def get_lessons(
+    request: TokenRequest,
+    course_id: Optional[int] = None,
+    completed: Optional[bool] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_db),
+):
+    await check_token_expiry(db, request.token)
+    columns = parse_fields(fields, LESSON_FIELDS, LESSON_SUMMARY_FIELDS)
+    after_id = decode_cursor(cursor, int)[0] if cursor else 0
     
     try:
-        user_id = get_user_by_token(db, request.token)
+        user_id = await get_user_by_token(db, request.token)
         
-        if is_admin(db, request.token):
-            lessons = db.execute(
-                text("SELECT id, title, description, education_content, course_id, duration_minutes FROM lessons")
-            ).fetchall()
-        else:
-            lessons = db.execute(
-                text("""
-                    SELECT DISTINCT l.id, l.title, l.description, l.education_content, l.course_id, l.duration_minutes 
-                    FROM lessons l
-                    INNER JOIN usersprogress up ON l.id = up.lesson_id
-                    WHERE up.user_id = :user_id
-                """),
-                {"user_id": user_id}
-            ).fetchall()
+        # Администратор видит все уроки, пользователь - только уроки своих курсов
+        join = "LEFT JOIN" if await is_admin(db, request.token) else "INNER JOIN"
+        filters = ["l.id > :after_id"]
+        params = {"user_id": user_id, "after_id": after_id, "limit": limit + 1}
+
+        if course_id is not None:
+            filters.append("l.course_id = :course_id")
+            params["course_id"] = course_id
+
+        if completed is not None:
+            filters.append("COALESCE(l.id = ANY(e.completed_lesson_ids), FALSE) = :completed")
+            params["completed"] = completed
+
+        query = f"""
+            SELECT {', '.join('l.' + column for column in columns)},
+                   COALESCE(l.id = ANY(e.completed_lesson_ids), FALSE) AS is_completed
+            FROM lessons l
+            {join} enrollments e ON e.course_id = l.course_id AND e.user_id = :user_id
+            WHERE {' AND '.join(filters)}
+            ORDER BY l.id
+            LIMIT :limit
+        """
+        lessons = (await db.execute(text(query), params)).fetchall()
         
-        if not lessons:
+        if not lessons and cursor is None:
             raise HTTPException(status_code=404, detail="Уроки не найдены")
+
+        lessons, next_cursor = split_page(lessons, limit, lambda lesson: (lesson.id,))
         
-        lessons_list = []
-        for lesson in lessons:
-            lessons_list.append({
-                "id": lesson.id,
-                "title": lesson.title,
-                "description": lesson.description,
-                "education_content": lesson.education_content,
-                "course_id": lesson.course_id,
-                "duration_minutes": lesson.duration_minutes,
-            })
+        lessons_list = [dict(lesson._mapping) for lesson in lessons]
         
         return {
             "status": "success",
             "count_lessons": len(lessons_list),
-            "lessons": lessons_list
+            "lessons": lessons_list,
+            "next_cursor": next_cursor
         }
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+# Содержимое урока. Ответ кэшируется клиентом и проверяется условным запросом по времени изменения урока
+@lesson_router.get("/{lesson_id}/content")
+async def get_lesson_content(
+    lesson_id: int,
+    token: str = Header(...),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
+    await check_token_expiry(db, token)
+
+    try:
+        lesson = (await db.execute(
+            text("SELECT course_id, COALESCE(updated_at, created_at) AS updated_at FROM lessons WHERE id = :lesson_id"),
+            {"lesson_id": lesson_id}
+        )).fetchone()
+
+        if not lesson:
+            raise HTTPException(status_code=404, detail="Урок не найден")
+
+        if not await is_admin(db, token) and not await is_user_in_course(db, token, lesson.course_id):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Ошибка доступа"
+            )
+
+        updated_at = lesson.updated_at.astimezone(timezone.utc)
+        etag = make_etag(f"{lesson_id}:{updated_at.isoformat()}".encode("utf-8"))
+        headers = {
+            "ETag": etag,
+            "Last-Modified": format_datetime(updated_at, usegmt=True),
+            "Cache-Control": "private, no-cache",
+        }
+
+        # If-Modified-Since учитывается только без If-None-Match
+        if if_none_match is not None:
+            not_modified = etag_matches(if_none_match, etag)
+        else:
+            not_modified = is_not_modified_since(if_modified_since, updated_at)
+
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+
+        content = (await db.execute(
+            text("SELECT education_content FROM lessons WHERE id = :lesson_id"),
+            {"lesson_id": lesson_id}
+        )).scalar()
+
+        return JSONResponse(
+            content={
+                "status": "success",
+                "lesson_id": lesson_id,
+                "education_content": content,
+                "updated_at": updated_at.isoformat()
+            },
+            headers=headers
+        )
+
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Создание нового урока
 @lesson_router.post("/create/course/{course_id}")
-def create_lesson(course_id: int, request: CreateLessonRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def create_lesson(course_id: int, request: CreateLessonRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Ошибка доступа"
         )
     try:
-        db.execute(
+        lesson_id = (await db.execute(
             text("""
                 INSERT INTO lessons (title, description, education_content, duration_minutes, course_id) 
                 VALUES (:title, :description, :education_content, :duration_minutes, :course_id)
+                RETURNING id
             """),
             {
                 "title": request.title,
@@ -93,34 +168,37 @@ def create_lesson(course_id: int, request: CreateLessonRequest):
                 "duration_minutes": request.duration_minutes,
                 "course_id": course_id
             }
+        )).scalar()
+
+        await db.execute(
+            text("UPDATE courses SET lessons_count = lessons_count + 1 WHERE id = :course_id"),
+            {"course_id": course_id}
         )
-        db.commit()
+        await db.commit()
+        retrieval.index_lesson(lesson_id, request.education_content)
         return {"status": "success", "message": "Урок создан"}
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Внесение изменений в урок
 @lesson_router.put("/update/{lesson_id}")
-def update_lesson(lesson_id: int, request: UpdateLessonRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def update_lesson(lesson_id: int, request: UpdateLessonRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Ошибка доступа"
         )
     try:
-        lesson = db.execute(
+        lesson = (await db.execute(
             text("SELECT id FROM lessons WHERE id = :lesson_id"),
             {"lesson_id": lesson_id}
-        ).fetchone()
+        )).fetchone()
 
         if not lesson:
             raise HTTPException(status_code=404, detail="Урок не найден")
@@ -150,250 +228,331 @@ def update_lesson(lesson_id: int, request: UpdateLessonRequest):
             update_fields.append("duration_minutes = :duration_minutes")
             params["duration_minutes"] = request.duration_minutes
         
+        update_fields.append("updated_at = NOW()")
         query = f"UPDATE lessons SET {', '.join(update_fields)} WHERE id = :lesson_id"
-        db.execute(text(query), params)
+        await db.execute(text(query), params)
+        await answer_cache.invalidate_lesson(db, lesson_id)
+        await task_pool.discard_lesson(db, lesson_id)
         
-        db.commit()
+        await db.commit()
+        if request.education_content is not None:
+            retrieval.index_lesson(lesson_id, request.education_content)
         return {"status": "success", "message": "Урок обновлен"}
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
     
 # Удаление урока
 @lesson_router.delete("/delete/{lesson_id}")
-def delete_lesson(lesson_id: int, request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def delete_lesson(lesson_id: int, request: TokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(status_code=403, detail="Ошибка доступа")
     
     try:
-        lesson = db.execute(
-            text("SELECT id FROM lessons WHERE id = :lesson_id"),
+        lesson = (await db.execute(
+            text("SELECT id, course_id FROM lessons WHERE id = :lesson_id"),
             {"lesson_id": lesson_id}
-        ).fetchone()
+        )).fetchone()
 
         if not lesson:
             raise HTTPException(status_code=404, detail="Урок не найден")
         
-        db.execute(
+        await db.execute(
             text("DELETE FROM lessons WHERE id = :lesson_id"),
             {"lesson_id": lesson_id}
         )
+
+        await db.execute(
+            text("UPDATE courses SET lessons_count = lessons_count - 1 WHERE id = :course_id"),
+            {"course_id": lesson.course_id}
+        )
+
+        await db.execute(
+            text("""
+                UPDATE enrollments
+                SET completed_lesson_ids = array_remove(completed_lesson_ids, :lesson_id),
+                    completed_count = completed_count - 1
+                WHERE course_id = :course_id AND :lesson_id = ANY(completed_lesson_ids)
+            """),
+            {"lesson_id": lesson_id, "course_id": lesson.course_id}
+        )
         
-        db.commit()
+        await db.commit()
+        retrieval.forget_lesson(lesson_id)
         return {"status": "success", "message": "Урок удален"}
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Отметка урока как пройденного
 @lesson_router.put("/complete/{lesson_id}")
-def complete_lesson(lesson_id: int, request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
+async def complete_lesson(lesson_id: int, request: TokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
     
-    user_id = get_user_by_token(db, request.token)
+    user_id = await get_user_by_token(db, request.token)
     
-    lesson_result = db.execute(
+    lesson_result = (await db.execute(
         text("SELECT course_id FROM lessons WHERE id = :lesson_id"),
         {"lesson_id": lesson_id}
-    ).fetchone()
+    )).fetchone()
     
     if not lesson_result:
         raise HTTPException(status_code=404, detail="Урок не найден")
     
     course_id = lesson_result[0]
     
-    if not is_user_in_course(db, request.token, course_id):
+    if not await is_user_in_course(db, request.token, course_id):
         raise HTTPException(status_code=403, detail="Ошибка доступа")
 
     try:
-        db.execute(
+        # Урок отмечается только один раз: повторная отметка не меняет прогресс и не создаёт событий достижений
+        progress = (await db.execute(
             text("""
-                UPDATE usersprogress 
-                SET is_completed = TRUE
-                WHERE user_id = :user_id AND lesson_id = :lesson_id
+                UPDATE enrollments e
+                SET completed_lesson_ids = array_append(e.completed_lesson_ids, :lesson_id),
+                    completed_count = e.completed_count + 1,
+                    updated_at = NOW()
+                FROM courses c
+                WHERE e.user_id = :user_id AND e.course_id = :course_id AND c.id = e.course_id
+                AND NOT (:lesson_id = ANY(e.completed_lesson_ids))
+                RETURNING e.completed_count, c.lessons_count
             """),
             {
                 "user_id": user_id,
+                "course_id": course_id,
                 "lesson_id": lesson_id
             }
-        )
+        )).fetchone()
 
-        process_achievement_event(db, "lesson_complete", user_id)
+        if progress:
+            await achievements.record_event(db, "lesson_complete", user_id)
 
-        total_lessons = db.execute(
-            text("SELECT COUNT(*) FROM lessons WHERE course_id = :course_id"),
-            {"course_id": course_id}
-        ).fetchone()[0]
-        
-        completed_lessons = db.execute(
-            text("""
-                SELECT COUNT(*) 
-                FROM usersprogress 
-                WHERE user_id = :user_id 
-                AND course_id = :course_id 
-                AND is_completed = TRUE
-            """),
-            {
-                "user_id": user_id,
-                "course_id": course_id
-            }
-        ).fetchone()[0]
-        
-        if completed_lessons >= total_lessons:
-            process_achievement_event(db, "course_complete", user_id)
+        # Курс засчитывается один раз: отметка ставится только при первом прохождении всех уроков
+        if progress and progress.completed_count >= progress.lessons_count:
+            course_completed = (await db.execute(
+                text("""
+                    UPDATE enrollments SET course_completed_at = NOW()
+                    WHERE user_id = :user_id AND course_id = :course_id AND course_completed_at IS NULL
+                    RETURNING id
+                """),
+                {"user_id": user_id, "course_id": course_id}
+            )).fetchone()
+
+            if course_completed:
+                await achievements.record_event(db, "course_complete", user_id)
         
-        db.commit()
+        await db.commit()
+        achievements.notify()
         return {"status": "success", "message": "Урок отмечен как завершённый"}
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
-# Запрос к нейросети с вопросом по уроку
-@lesson_router.post("/{lesson_id}/ask")
-def ask_question(lesson_id: int, request: AskLessonRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
+# Урок для вопроса к нейросети с проверкой доступа
+async def get_lesson_for_question(db, token: str, lesson_id: int):
+    await check_token_expiry(db, token)
     
-    lesson_result = db.execute(
+    lesson_result = (await db.execute(
         text("SELECT * FROM lessons WHERE id = :lesson_id"),
         {"lesson_id": lesson_id}
-    ).fetchone()
+    )).fetchone()
     
     if not lesson_result:
         raise HTTPException(status_code=404, detail="Урок не найден")
 
-    if not is_user_in_course(db, request.token, lesson_result.course_id) and not is_admin(db, request.token):
+    if not await is_user_in_course(db, token, lesson_result.course_id) and not await is_admin(db, token):
         raise HTTPException(status_code=403, detail="Ошибка доступа")
 
-    try:
-        prompt = f"""Ты - AI-репетитор. 
+    return lesson_result
+
+# Промпт AI-репетитора с контекстом урока
+def build_question_prompt(lesson, ask: str) -> str:
+    return f"""Ты - AI-репетитор. 
             Контекст урока:
-            1) Название урока: {lesson_result.title}
-            2) Описание урока: {lesson_result.description}  
-            3) Обучающий контент: {lesson_result.education_content}
-            Вопрос студента: {request.ask}
+            1) Название урока: {lesson.title}
+            2) Описание урока: {lesson.description}  
+            3) Обучающий контент: {retrieval.build_context(lesson, ask)}
+            Вопрос студента: {ask}
             Дай развернутый, но четкий ответ, основанный на предоставленном контексте. Если ответа в контексте нет, так и скажи.
             Ответ предоставь в виде чистого текста, без использования спец. символов и разметки MarkDown!
             Код пиши строго строкой/строками в предложении, а не в отдельных окнах!!!"""
-        
-        response = query_ai(prompt)
 
-        db.commit()
+# Событие Server-Sent Events
+def sse_event(data: dict, event: str = None) -> str:
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Запрос к нейросети с вопросом по уроку.
+# Соединение с БД не удерживается во время ожидания и выполнения запроса к нейросети
+@lesson_router.post("/{lesson_id}/ask")
+async def ask_question(lesson_id: int, request: AskLessonRequest):
+    async with db_session() as db:
+        lesson_result = await get_lesson_for_question(db, request.token, lesson_id)
+        response = await answer_cache.get_answer(db, lesson_result, request.ask)
+
+    if response is not None:
         return {"status": "success", "responseai": response}
-    
+
+    try:
+        response = await ai.chat(build_question_prompt(lesson_result, request.ask))
+    except HTTPException:
+        raise
+    except Exception as e:
+        return {"status": "success", "responseai": f"Ошибка: {str(e)}"}
+
+    try:
+        async with db_session() as db:
+            await answer_cache.save_answer(db, lesson_result, request.ask, response)
+            await db.commit()
+        return {"status": "success", "responseai": response}
+
     except HTTPException:
-        db.rollback()
         raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
+
+# Потоковый ответ нейросети на вопрос по уроку (Server-Sent Events).
+# Соединение с БД нужно только для проверок и возвращается в пул до начала генерации
+@lesson_router.post("/{lesson_id}/ask/stream")
+async def ask_question_stream(lesson_id: int, request: AskLessonRequest):
+    async with db_session() as db:
+        lesson_result = await get_lesson_for_question(db, request.token, lesson_id)
+        cached_answer = await answer_cache.get_answer(db, lesson_result, request.ask)
+
+    prompt = build_question_prompt(lesson_result, request.ask)
+    if cached_answer is None:
+        ai.ensure_available()
+
+    async def events():
+        if cached_answer is not None:
+            yield sse_event({"text": cached_answer})
+            yield sse_event({"status": "success"}, event="done")
+            return
+
+        try:
+            parts = []
+            async for text_chunk in ai.stream(prompt):
+                parts.append(text_chunk)
+                yield sse_event({"text": text_chunk})
+
+            async with db_session() as db:
+                await answer_cache.save_answer(db, lesson_result, request.ask, "".join(parts))
+                await db.commit()
+            yield sse_event({"status": "success"}, event="done")
+        except HTTPException as e:
+            yield sse_event({"detail": e.detail}, event="error")
+        except Exception as e:
+            yield sse_event({"detail": f"Ошибка: {str(e)}"}, event="error")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
     
-# Запрос к нейросети с генерацией вопроса по уроку
+# Сохранение сгенерированной задачи пользователя (фиксируется вызывающим кодом)
+async def save_generated_task(db, user_id: int, lesson_id: int, task: str, answer_right: str):
+    await db.execute(
+        text("""
+            INSERT INTO tasks (user_id, lesson_id, task, answer_right) 
+            VALUES (:user_id, :lesson_id, :task, :answer_right)
+        """),
+        {
+            "user_id": user_id,
+            "lesson_id": lesson_id,
+            "task": task,
+            "answer_right": answer_right,
+        }
+    )
+
+# Запрос к нейросети с генерацией вопроса по уроку.
+# Готовая задача из пула сохраняется сразу; при пустом пуле соединение с БД возвращается в пул на время генерации
 @lesson_router.post("/{lesson_id}/generate-task")
-def generate_task(lesson_id: int, request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
+async def generate_task(lesson_id: int, request: TokenRequest):
+    try:
+        async with db_session() as db:
+            await check_token_expiry(db, request.token)
+            
+            lesson_result = (await db.execute(
+                text("SELECT * FROM lessons WHERE id = :lesson_id"),
+                {"lesson_id": lesson_id}
+            )).fetchone()
+            
+            if not lesson_result:
+                raise HTTPException(status_code=404, detail="Урок не найден")
+
+            if not await is_user_in_course(db, request.token, lesson_result.course_id) and not await is_admin(db, request.token):
+                raise HTTPException(status_code=403, detail="Ошибка доступа")
+
+            user_id = await get_user_by_token(db, request.token)
+
+            pooled_task = await task_pool.claim_task(db, lesson_id)
+            if pooled_task:
+                await save_generated_task(db, user_id, lesson_id, pooled_task.task, pooled_task.answer_right)
+                await db.commit()
+                return {
+                    "status": "success", 
+                    "task": pooled_task.task,
+                }
+
+        task_pool.request_refill(lesson_id)
+        response = await query_ai(task_pool.build_task_prompt(lesson_result))
+        task, answer_right = task_pool.parse_task_response(response)
+
+        async with db_session() as db:
+            await save_generated_task(db, user_id, lesson_id, task, answer_right)
+            await db.commit()
+
+        return {
+            "status": "success", 
+            "task": task,
+        }
     
-    lesson_result = db.execute(
-        text("SELECT * FROM lessons WHERE id = :lesson_id"),
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+# Генерация задачи через очередь заданий: ответ сразу, результат - через /api/job/{job_id}
+@lesson_router.post("/{lesson_id}/generate-task/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def generate_task_job(lesson_id: int, request: TokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+
+    lesson_result = (await db.execute(
+        text("SELECT course_id FROM lessons WHERE id = :lesson_id"),
         {"lesson_id": lesson_id}
-    ).fetchone()
-    
+    )).fetchone()
+
     if not lesson_result:
         raise HTTPException(status_code=404, detail="Урок не найден")
 
-    if not is_user_in_course(db, request.token, lesson_result.course_id) and not is_admin(db, request.token):
+    if not await is_user_in_course(db, request.token, lesson_result.course_id) and not await is_admin(db, request.token):
         raise HTTPException(status_code=403, detail="Ошибка доступа")
 
     try:
-        prompt = f"""
-            Сгенерируй одну практическую задачу по уроку:
-            1) Название урока: {lesson_result.title}
-            2) Описание урока: {lesson_result.description}
-            3) Обучающий контент: {lesson_result.education_content}
-            
-            Задача должна быть уникальной и проверять понимание ключевых концепций.
-            Уровень сложности - начальный. Предоставь эталонное решение для проверки.
-
-            Твой ответ должен СТРОГО соответствовать шаблону:
-            Задача: [текст задачи]
-            Эталонное решение: [решение задачи]
-
-            ЗАПРЕЩЕНО использовать Markdown, обратные кавычки ```, символы форматирования!
-            Решение должно быть написано обычным текстом в одну строку!"""
-
-        response = query_ai(prompt)
-
-        def clean_markdown(text):
-            text = re.sub(r'```[a-z]*\n?', '', text)
-            text = text.replace('```', '')
-            text = text.replace('**', '').replace('*', '').replace('_', '')
-            text = re.sub(r'\n+', ' ', text)
-            return text.strip()
-
-        clean_response = clean_markdown(response)
-
-        if 'Эталонное решение:' in clean_response:
-            parts = clean_response.split('Эталонное решение:', 1)
-            task = parts[0].replace('Задача:', '').strip()
-            answer_right = parts[1].strip()
-        elif 'эталонное решение:' in clean_response:
-            parts = clean_response.split('эталонное решение:', 1)
-            task = parts[0].replace('Задача:', '').strip()
-            answer_right = parts[1].strip()
-        else:
-            task = clean_response.strip()
-            answer_right = ""
+        user_id = await get_user_by_token(db, request.token)
+        job_id = await jobs.enqueue_job(db, "generate_task", user_id, lesson_id)
+        await db.commit()
+        jobs.notify()
 
-        user_id = get_user_by_token(db, request.token)
-        
-        db.execute(
-            text("""
-                INSERT INTO tasks (user_id, lesson_id, task, answer_right) 
-                VALUES (:user_id, :lesson_id, :task, :answer_right)
-            """),
-            {
-                "user_id": user_id,
-                "lesson_id": lesson_id,
-                "task": task,
-                "answer_right": answer_right,
-            }
-        )
+        return {"status": "accepted", "job_id": job_id}
 
-        db.commit()
-        return {
-            "status": "success", 
-            "task": task,
-        }
-    
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
\ No newline at end of file
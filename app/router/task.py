@@ -1,41 +1,62 @@
-import re
-from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
 import os
+import re
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
+from json_repair import repair_json
 
-from app.models import CheckTaskRequest, TokenRequest
-from app.utils import check_token_expiry, get_user_by_token, is_admin, process_achievement_event, query_ai
+from app import achievements, grading
+from app.database import db_session, get_db
+from app.models import BatchCheckTaskRequest, CheckTaskRequest, TokenRequest
+from app.utils import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, check_token_expiry, decode_cursor, get_user_by_token, is_admin, query_ai, split_page
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TASK_BATCH_MAX_SIZE = int(os.getenv("TASK_BATCH_MAX_SIZE", 20))
 
 task_router = APIRouter(prefix="/api/task", tags=["Task API"])
 
 # Получение всех задач пользователя
 @task_router.post("")
-def get_tasks(request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
+async def get_tasks(
+    request: TokenRequest,
+    lesson_id: Optional[int] = None,
+    is_answer_right: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_db),
+):
+    await check_token_expiry(db, request.token)
+    after_id = decode_cursor(cursor, int)[0] if cursor else 0
 
-    user_id = get_user_by_token(db, request.token)
+    user_id = await get_user_by_token(db, request.token)
     try:
-        tasks = db.execute(
-            text("""
-                SELECT *
-                FROM tasks 
-                WHERE user_id = :user_id 
-            """),
-            {"user_id": user_id}
-        ).fetchall()
+        filters = ["user_id = :user_id", "id > :after_id"]
+        params = {"user_id": user_id, "after_id": after_id, "limit": limit + 1}
+
+        if lesson_id is not None:
+            filters.append("lesson_id = :lesson_id")
+            params["lesson_id"] = lesson_id
+
+        if is_answer_right is not None:
+            filters.append("is_answer_right = :is_answer_right")
+            params["is_answer_right"] = is_answer_right
+
+        query = f"""
+            SELECT id, task, answer_right, answer_user, is_answer_right
+            FROM tasks 
+            WHERE {' AND '.join(filters)}
+            ORDER BY id
+            LIMIT :limit
+        """
+        tasks = (await db.execute(text(query), params)).fetchall()
         
-        if not tasks:
+        if not tasks and cursor is None:
             raise HTTPException(status_code=404, detail="Задачи не найдены")
+
+        tasks, next_cursor = split_page(tasks, limit, lambda task: (task.id,))
         
         tasks_list = []
         for task in tasks:
@@ -54,45 +75,22 @@ def get_tasks(request: TokenRequest):
         return {
             "status": "success",
             "count_tasks": len(tasks_list),
-            "tasks": tasks_list
+            "tasks": tasks_list,
+            "next_cursor": next_cursor
         }
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
-
-@task_router.put("/{task_id}/check-task")
-def check_task(task_id: int, request: CheckTaskRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    
-    user_id = get_user_by_token(db, request.token)
-    
-    task_result = db.execute(
-        text("SELECT * FROM tasks WHERE id = :task_id AND user_id = :user_id"),
-        {"task_id": task_id, "user_id": user_id}
-    ).fetchone()
-    
-    if not task_result:
-        raise HTTPException(status_code=404, detail="Задача не найдена")
-    
-    if task_result.is_answer_right:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Верный ответ на задачу уже был предоставлен"
-        )
-    
-    task = task_result.task
-    answer_right = task_result.answer_right
 
-    prompt = f"""
+# Промпт для проверки ответа на задачу
+def build_check_prompt(task: str, answer: str, answer_right: str) -> str:
+    return f"""
                 Задача: {task}
-                Ответ студента: {request.answer}
+                Ответ студента: {answer}
                 Эталонное решение: {answer_right}
 
                 Проанализируй ответ студента по следующим критериям:
@@ -115,29 +113,125 @@ def check_task(task_id: int, request: CheckTaskRequest):
 
                 Ответ дай СТРОГО одним словом: true или false
             """
+
+# Промпт для проверки ответов на несколько задач одним запросом
+def build_batch_check_prompt(items: list) -> str:
+    tasks_text = "\n".join(
+        f"""
+                Задача {number}:
+                Условие: {task}
+                Ответ студента: {answer}
+                Эталонное решение: {answer_right}"""
+        for number, task, answer, answer_right in items
+    )
+
+    return f"""
+                Проверь ответы студента на несколько задач.
+                {tasks_text}
+
+                Проанализируй каждый ответ студента по следующим критериям:
+                1. Корректность синтаксиса (правильность написания кода)
+                2. Соответствие логике задачи
+                3. Достижение поставленной цели
+                4. Использование правильных конструкций языка
+
+                Ответ студента считается ВЕРНЫМ (true), если синтаксис корректен, логика соответствует задаче,
+                достигнут ожидаемый результат. Допускаются незначительные отклонения в формулировках.
+                Ответ студента считается НЕВЕРНЫМ (false) при синтаксических ошибках, неправильной логике,
+                недостигнутом результате или существенных отклонениях от эталона.
+
+                Ответ дай СТРОГО JSON-массивом без пояснений, по одному элементу на задачу:
+                [{{"id": 1, "correct": true}}, {{"id": 2, "correct": false}}]
+            """
+
+# Разбор ответа нейросети на пакетную проверку: {номер задачи: верен ли ответ}
+def parse_batch_verdicts(response: str) -> dict:
+    parsed = repair_json(response, return_objects=True)
+    if isinstance(parsed, dict):
+        parsed = [parsed]
+    if not isinstance(parsed, list):
+        return {}
+
+    verdicts = {}
+    for item in parsed:
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            continue
+
+        correct = item.get("correct")
+        if isinstance(correct, str):
+            correct = correct.strip().lower() == "true"
+        if isinstance(correct, bool):
+            verdicts[item["id"]] = correct
+    return verdicts
+
+# Сохранение ответа на задачу, если верный ответ на неё ещё не был дан (фиксируется вызывающим кодом).
+# Возвращает False, если задача уже решена, в том числе параллельным запросом
+async def save_task_answer(db, task_id: int, user_id: int, answer: str, is_correct: bool) -> bool:
+    updated = (await db.execute(
+        text("""
+            UPDATE tasks 
+            SET is_answer_right = :is_correct, answer_user = :answer
+            WHERE id = :task_id AND user_id = :user_id AND is_answer_right IS NOT TRUE
+        """),
+        {
+            "is_correct": is_correct,
+            "answer": answer,
+            "task_id": task_id,
+            "user_id": user_id
+        }
+    )).rowcount
+
+    if updated:
+        await achievements.record_event(db, "task_completed", user_id, is_correct)
+    return bool(updated)
+
+# Проверка ответа на задачу. Соединение с БД не удерживается во время запроса к нейросети
+@task_router.put("/{task_id}/check-task")
+async def check_task(task_id: int, request: CheckTaskRequest):
+    async with db_session() as db:
+        await check_token_expiry(db, request.token)
+        
+        user_id = await get_user_by_token(db, request.token)
         
-    response = query_ai(prompt)
+        task_result = (await db.execute(
+            text("SELECT * FROM tasks WHERE id = :task_id AND user_id = :user_id"),
+            {"task_id": task_id, "user_id": user_id}
+        )).fetchone()
+    
+    if not task_result:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    
+    if task_result.is_answer_right:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Верный ответ на задачу уже был предоставлен"
+        )
+    
+    task = task_result.task
+    answer_right = task_result.answer_right
+
+    prompt = build_check_prompt(task, request.answer, answer_right)
+        
+    # Очевидные случаи проверяются локально, без запроса к нейросети
+    verdict = grading.pre_grade(request.answer, answer_right)
+    if verdict is not None:
+        response = "true" if verdict else "false"
+    else:
+        response = await query_ai(prompt)
+    grading.record_verdict(local=verdict is not None)
 
     is_correct = response.strip().lower() == 'true'
 
     try:
-        db.execute(
-            text("""
-                UPDATE tasks 
-                SET is_answer_right = :is_correct, answer_user = :answer
-                WHERE id = :task_id AND user_id = :user_id
-            """),
-            {
-                "is_correct": is_correct,
-                "answer": request.answer,
-                "task_id": task_id,
-                "user_id": user_id
-            }
-        )
+        async with db_session() as db:
+            if not await save_task_answer(db, task_id, user_id, request.answer, is_correct):
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Верный ответ на задачу уже был предоставлен"
+                )
+            await db.commit()
 
-        process_achievement_event(db, "task_completed", user_id, is_correct)
-        
-        db.commit()
+        achievements.notify()
         return {
             "status": "success", 
             "is_correct": is_correct,
@@ -145,10 +239,107 @@ def check_task(task_id: int, request: CheckTaskRequest):
         }
     
     except HTTPException:
-        db.rollback()
         raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
+
+
+# Проверка ответов на несколько задач: нейросеть оценивает все ответы одним запросом,
+# изменения задач и события достижений записываются в порядке ответов одной транзакцией.
+# Соединение с БД не удерживается во время запроса к нейросети
+@task_router.put("/check-tasks")
+async def check_tasks(request: BatchCheckTaskRequest):
+    if not request.answers:
+        raise HTTPException(status_code=400, detail="Не указаны ответы")
+
+    if len(request.answers) > TASK_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"За один запрос можно проверить не более {TASK_BATCH_MAX_SIZE} задач"
+        )
+
+    try:
+        async with db_session() as db:
+            await check_token_expiry(db, request.token)
+            user_id = await get_user_by_token(db, request.token)
+
+            tasks = {
+                task.id: task
+                for task in (await db.execute(
+                    text("""
+                        SELECT id, task, answer_right, is_answer_right
+                        FROM tasks
+                        WHERE id = ANY(CAST(:task_ids AS INTEGER[])) AND user_id = :user_id
+                    """),
+                    {"task_ids": [item.task_id for item in request.answers], "user_id": user_id}
+                )).fetchall()
+            }
+
+        # Очевидные случаи проверяются локально, остальные - одним запросом к нейросети
+        verdicts = {}
+        pending = []
+        for index, item in enumerate(request.answers):
+            task = tasks.get(item.task_id)
+            if task is None or task.is_answer_right:
+                continue
+
+            verdict = grading.pre_grade(item.answer, task.answer_right)
+            if verdict is None:
+                pending.append(index)
+            else:
+                verdicts[index] = (verdict, "local")
+                grading.record_verdict(local=True)
+
+        if pending:
+            response = await query_ai(build_batch_check_prompt([
+                (number, tasks[request.answers[index].task_id].task, request.answers[index].answer, tasks[request.answers[index].task_id].answer_right)
+                for number, index in enumerate(pending, 1)
+            ]))
+            ai_verdicts = parse_batch_verdicts(response)
+
+            # Ответы без разобранного вердикта (ошибка нейросети, неполный или испорченный JSON)
+            # не считаются неверными: задачи не меняются, серия верных ответов не сбрасывается
+            for number, index in enumerate(pending, 1):
+                if number in ai_verdicts:
+                    verdicts[index] = (ai_verdicts[number], "ai")
+                    grading.record_verdict(local=False)
+
+            if not verdicts:
+                raise HTTPException(status_code=503, detail="Не удалось проверить ответы, повторите запрос позже")
+
+        results = []
+        async with db_session() as db:
+            for index, item in enumerate(request.answers):
+                task = tasks.get(item.task_id)
+                if task is None:
+                    results.append({"task_id": item.task_id, "status": "not_found"})
+                    continue
+
+                if task.is_answer_right:
+                    results.append({"task_id": item.task_id, "status": "already_correct"})
+                    continue
+
+                if index not in verdicts:
+                    results.append({"task_id": item.task_id, "status": "unchecked"})
+                    continue
+
+                is_correct, checked_by = verdicts[index]
+                if not await save_task_answer(db, item.task_id, user_id, item.answer, is_correct):
+                    results.append({"task_id": item.task_id, "status": "already_correct"})
+                    continue
+
+                results.append({"task_id": item.task_id, "status": "checked", "is_correct": is_correct, "checked_by": checked_by})
+
+            await db.commit()
+
+        achievements.notify()
+        return {
+            "status": "success",
+            "count_correct": sum(1 for result in results if result.get("is_correct")),
+            "results": results
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
@@ -1,38 +1,35 @@
-from datetime import datetime, timedelta
+import codecs
+import csv
+from datetime import datetime, timedelta, timezone
 import random
 import secrets
 import smtplib
-from fastapi import APIRouter, HTTPException, status
-from app.models import ChangePasswordRequest, EmailTokenRequest, LoginRequest, TokenRequest, RegisterRequest, VerifyRequest
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from app.database import get_db
+from app.models import BulkEmailTokenRequest, ChangePasswordRequest, EmailTokenRequest, LoginRequest, TokenRequest, RegisterRequest, VerifyRequest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from dotenv import load_dotenv
-import bcrypt
 from jose import jwt
+from pydantic import EmailStr, TypeAdapter, ValidationError
 from email.mime.text import MIMEText
 import hashlib
 
-from app.utils import check_token_expiry, get_user_by_email, get_user_by_token, hash_token, is_admin, is_existing_token
+from app import passwords
+from app.utils import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, check_token_expiry, decode_cursor, get_user_by_email, get_user_by_token, hash_token, invalidate_auth_context, is_admin, is_existing_token, run_blocking, split_page
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
+BULK_ENROLLMENT_BATCH_SIZE = int(os.getenv("BULK_ENROLLMENT_BATCH_SIZE", 1000))
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_email_adapter = TypeAdapter(EmailStr)
 
-# Вспомогательные методы
-def get_text_hash(text: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(text.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
-
-def verify_text_hash(plain_text: str, hashed_text: str) -> bool:
-    return bcrypt.checkpw(plain_text.encode('utf-8'), hashed_text.encode('utf-8'))
 
+# Вспомогательные методы
 def create_jwt_token(user_id: str) -> str:
     jti = secrets.token_urlsafe(16)
     return jwt.encode(
@@ -41,69 +38,165 @@ def create_jwt_token(user_id: str) -> str:
         algorithm=ALGORITHM
     )
 
-def send_verify_code_to_email(db, user_id: int, email: str):
+def send_email(email: str, subject: str, message: str):
     smtp_server = os.getenv("SMTP_SERVER")
     smtp_port = os.getenv("SMTP_PORT")
     smtp_username = os.getenv("SMTP_USERNAME")
     smtp_password = os.getenv("SMTP_PASSWORD")
+
+    msg = MIMEText(message)
+    msg['Subject'] = subject
+    msg['From'] = smtp_username
+    msg['To'] = email
+    
+    server = smtplib.SMTP(smtp_server, smtp_port)
+    server.starttls()
+    server.login(smtp_username, smtp_password)
+    server.send_message(msg)
+    server.quit()
+
+async def send_verify_code_to_email(db, user_id: int, email: str):
     code = random.randint(100000, 999999)
     
     subject = "Подтверждение email"
     message = f"""Код подтверждения: {code}"""
 
     try:
-        db.execute(
+        await db.execute(
             text("DELETE FROM verify_codes WHERE user_id = :user_id"),
             {"user_id": user_id}
         )
 
-        db.execute(
+        await db.execute(
             text("""
                 INSERT INTO verify_codes (user_id, code_hash) 
                 VALUES (:user_id, :code)
             """),
             {
                 "user_id": user_id,
-                "code": get_text_hash(str(code))
+                "code": await passwords.hash_password(str(code))
             }
         )
         
-        db.commit()
+        await db.commit()
 
-        msg = MIMEText(message)
-        msg['Subject'] = subject
-        msg['From'] = smtp_username
-        msg['To'] = email
-        
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_username, smtp_password)
-        server.send_message(msg)
-        server.quit()
+        await run_blocking("smtp", send_email, email, subject, message)
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise Exception(f"Ошибка отправки кода подтверждения: {str(e)}")
 
+# Зачисление пользователей на курс одним запросом
+async def enroll_users(db, course_id: int, user_ids: list):
+    await db.execute(
+        text("""
+            INSERT INTO enrollments (user_id, course_id)
+            SELECT u.user_id, :course_id
+            FROM unnest(CAST(:user_ids AS INTEGER[])) AS u(user_id)
+            ON CONFLICT (user_id, course_id) DO NOTHING
+        """),
+        {"user_ids": user_ids, "course_id": course_id}
+    )
+
+# Отчисление пользователей с курса одним запросом
+async def dismiss_users(db, course_id: int, user_ids: list):
+    await db.execute(
+        text("""
+            DELETE FROM enrollments e
+            USING unnest(CAST(:user_ids AS INTEGER[])) AS d(user_id)
+            WHERE e.user_id = d.user_id AND e.course_id = :course_id
+        """),
+        {"user_ids": user_ids, "course_id": course_id}
+    )
+
+# Пользователи по списку Email и признак их зачисления на курс: [(email, user_id | None, is_enrolled)]
+async def get_enrollment_status(db, course_id: int, emails: list) -> list:
+    return (await db.execute(
+        text("""
+            SELECT e.email, u.id AS user_id,
+                EXISTS (
+                    SELECT 1 FROM enrollments en
+                    WHERE en.user_id = u.id AND en.course_id = :course_id
+                ) AS is_enrolled
+            FROM unnest(CAST(:emails AS VARCHAR[])) WITH ORDINALITY AS e(email, position)
+            LEFT JOIN users u ON u.email = e.email
+            ORDER BY e.position
+        """),
+        {"emails": emails, "course_id": course_id}
+    )).fetchall()
+
+# Массовое зачисление/отчисление пачки Email в текущей транзакции, возвращает результат по каждому Email
+async def process_enrollment_batch(db, course_id: int, emails: list, enroll: bool) -> list:
+    rows = await get_enrollment_status(db, course_id, list(dict.fromkeys(emails)))
+
+    results = []
+    user_ids = []
+    for row in rows:
+        if row.user_id is None:
+            result_status = "not_found"
+        elif enroll and row.is_enrolled:
+            result_status = "already_enrolled"
+        elif not enroll and not row.is_enrolled:
+            result_status = "not_enrolled"
+        else:
+            result_status = "enrolled" if enroll else "dismissed"
+            user_ids.append(row.user_id)
+        results.append({"email": row.email, "user_id": row.user_id, "status": result_status})
+
+    if user_ids:
+        if enroll:
+            await enroll_users(db, course_id, user_ids)
+        else:
+            await dismiss_users(db, course_id, user_ids)
+
+    return results
+
+# Чтение Email из CSV, переданного телом запроса (первая колонка, строки читаются по мере поступления).
+# Декодер с состоянием: символ UTF-8, разрезанный между частями тела, собирается из соседних частей
+async def read_csv_emails(request: Request):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            email = parse_csv_email(line)
+            if email:
+                yield email
+
+    email = parse_csv_email(buffer + decoder.decode(b"", final=True))
+    if email:
+        yield email
+
+# Email из первой колонки строки CSV, нормализованный так же, как EmailStr в JSON-запросах;
+# None для заголовка, пустых строк и некорректных адресов
+def parse_csv_email(line: str):
+    row = next(csv.reader([line.strip()]), None)
+    if not row or "@" not in row[0]:
+        return None
+
+    try:
+        return _email_adapter.validate_python(row[0].strip())
+    except ValidationError:
+        return None
 
 user_router = APIRouter(prefix="/api/user", tags=["User API"])
 
 # Регистрация
 @user_router.post("/register")
-def register(request: RegisterRequest):
-    db = SessionLocal()
+async def register(request: RegisterRequest, db: AsyncSession = Depends(get_db)):
     try:
-        result = db.execute(
+        result = (await db.execute(
             text("SELECT id FROM users WHERE email = :email"),
             {"email": request.email}
-        ).fetchone()
+        )).fetchone()
         
         if result:
             raise HTTPException(status_code=400, detail="Пользователь с таким email уже существует")
         
-        password_hash = get_text_hash(request.password)
+        password_hash = await passwords.hash_password(request.password)
         
-        db.execute(
+        await db.execute(
             text("""
                 INSERT INTO users (firstname, surname, email, password_hash) 
                 VALUES (:firstname, :surname, :email, :password_hash)
@@ -116,14 +209,14 @@ def register(request: RegisterRequest):
             }
         )
 
-        result = db.execute(
+        result = (await db.execute(
             text("SELECT id FROM users WHERE email = :email"),
             {"email": request.email}
-        ).fetchone()
+        )).fetchone()
 
         user_id = result[0]
 
-        db.execute(
+        await db.execute(
             text("""
                 INSERT INTO usersprogress_stats (user_id) 
                 VALUES (:user_id)
@@ -133,121 +226,124 @@ def register(request: RegisterRequest):
             }
         )
 
-        send_verify_code_to_email(db, user_id, request.email)
+        await send_verify_code_to_email(db, user_id, request.email)
 
-        db.commit()
+        await db.commit()
         return {"status": "success", "message": "Пользователь зарегистрирован. Код подтверждения отправлен на указаный Email"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Подтверждение/активация пользователя
 @user_router.put("/verify")
-def verify(request: VerifyRequest):
-    db = SessionLocal()
+async def verify(request: VerifyRequest, db: AsyncSession = Depends(get_db)):
     try:
-        user_id = get_user_by_email(db, request.email)
+        user_id = await get_user_by_email(db, request.email)
 
-        is_verify = db.execute(
+        is_verify = (await db.execute(
             text("SELECT is_verify FROM users WHERE email = :email"),
             {"email": request.email}
-        ).fetchone()
+        )).fetchone()
         
         if is_verify[0]:
             raise HTTPException(status_code=400, detail="Аккаунт уже подтверждён")
         
-        code_result = db.execute(
+        code_result = (await db.execute(
             text("SELECT code_hash FROM verify_codes WHERE user_id = :user_id"),
             {"user_id": user_id}
-        ).fetchone()
+        )).fetchone()
 
         if not code_result:
             raise HTTPException(status_code=400, detail="Код подтверждения не найден")
 
-        if not verify_text_hash(request.code, code_result[0]):
+        if not await passwords.verify_password(request.code, code_result[0]):
             raise HTTPException(status_code=400, detail="Неверный код подтверждения")
             
-        db.execute(
+        await db.execute(
             text("UPDATE users SET is_verify = TRUE WHERE id = :user_id"),
             {"user_id": user_id}
         )
 
-        db.execute(
+        await db.execute(
             text("DELETE FROM verify_codes WHERE user_id = :user_id"),
             {"user_id": user_id}
         )
 
-        db.commit()
+        await db.commit()
         return {"status": "success", "message": "Учётная запись пользователя активирована"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Авторизация
 @user_router.post("/login")
-def login(request: LoginRequest):
-    db = SessionLocal()
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
     try:
-        user = db.execute(
+        user = (await db.execute(
             text("SELECT * FROM users WHERE email = :email"),
             {"email": request.email}
-        ).fetchone()
+        )).fetchone()
         
         if not user:
             raise HTTPException(status_code=400, detail="Пользователь с таким email не существует")
         
-        if not verify_text_hash(request.password, user.password_hash):
+        if not await passwords.verify_password(request.password, user.password_hash):
             raise HTTPException(status_code=400, detail="Неверный пароль")
+
+        # Хэш, созданный с меньшей стоимостью bcrypt, пересчитывается с текущей
+        new_password_hash = await passwords.rehash_if_needed(request.password, user.password_hash)
+        if new_password_hash:
+            await db.execute(
+                text("UPDATE users SET password_hash = :password_hash WHERE id = :user_id"),
+                {"password_hash": new_password_hash, "user_id": user.id}
+            )
         
         if not user.is_verify:
-            send_verify_code_to_email(db, user.id, user.email)
+            await send_verify_code_to_email(db, user.id, user.email)
             raise HTTPException(
                 status_code=403,
                 detail="Аккаунт не подтвержден. Код подтверждения отправлен на email"
             )
 
-        token_count_result = db.execute(
+        token_count_result = (await db.execute(
             text("SELECT COUNT(*) FROM personal_access_tokens WHERE user_id = :user_id"),
             {"user_id": user.id}
-        ).fetchone()
+        )).fetchone()
         token_count = token_count_result[0] if token_count_result else 0
         
         MAX_COUNT_ACCESS_TOKENS = int(os.getenv("MAX_COUNT_ACCESS_TOKENS", 3))
         ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 1440))
 
         if token_count >= MAX_COUNT_ACCESS_TOKENS:
-            oldest_token = db.execute(
+            oldest_token = (await db.execute(
                 text("""
-                    SELECT id FROM personal_access_tokens 
+                    SELECT id, token FROM personal_access_tokens 
                     WHERE user_id = :user_id 
                     ORDER BY created_at ASC 
                     LIMIT 1
                 """),
                 {"user_id": user.id}
-            ).fetchone()
+            )).fetchone()
             
             if oldest_token:
-                db.execute(
+                await db.execute(
                     text("DELETE FROM personal_access_tokens WHERE id = :token_id"),
                     {"token_id": oldest_token.id}
                 )
+                invalidate_auth_context(token_hash=oldest_token.token)
         
         token = create_jwt_token(str(user.id))
-        expires_at = datetime.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expires_at = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         
-        db.execute(
+        await db.execute(
             text("""
                 INSERT INTO personal_access_tokens (user_id, token, expires_at) 
                 VALUES (:user_id, :token, :expires_at)
@@ -259,7 +355,7 @@ def login(request: LoginRequest):
             }
         )
 
-        db.commit()
+        await db.commit()
         return {
             "status": "success", 
             "token": token,
@@ -268,204 +364,250 @@ def login(request: LoginRequest):
         }
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Конец сессии
 @user_router.delete("/logout")
-def logout(request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
+async def logout(request: TokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
 
-    if not is_existing_token(db, request.token):
+    if not await is_existing_token(db, request.token):
             raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Токен не найден"
         )
     
     try:
-        db.execute(
+        await db.execute(
             text("DELETE FROM personal_access_tokens WHERE token = :token"),
             {"token": hash_token(request.token)}
         )
-        db.commit()
+        await db.commit()
+        invalidate_auth_context(token=request.token)
         return {"out_token": "success"}
     
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Зачисление пользователя на курс
 @user_router.post("/enroll/{course_id}")
-def enroll_user_to_course(course_id: int, request: EmailTokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def enroll_user_to_course(course_id: int, request: EmailTokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Ошибка доступа"
         )
     
     try:
-        user_id = get_user_by_email(db, request.email)
-        result = db.execute(
-            text("SELECT id FROM usersprogress WHERE user_id = :user_id AND course_id = :course_id"),
+        user_id = await get_user_by_email(db, request.email)
+        result = (await db.execute(
+            text("SELECT id FROM enrollments WHERE user_id = :user_id AND course_id = :course_id"),
             {"user_id": user_id, "course_id": course_id}
-        ).fetchone()
+        )).fetchone()
 
         if result:
             raise HTTPException(status_code=400, detail="Пользователь уже зачислен на данный курс")
         
-        lessons = db.execute(
-            text("SELECT id FROM lessons WHERE course_id = :course_id"),
-            {"course_id": course_id}
-        ).fetchall()
-
-        for lesson in lessons:
-            db.execute(
-                text("""
-                    INSERT INTO usersprogress (user_id, course_id, lesson_id) 
-                    VALUES (:user_id, :course_id, :lesson_id)
-                """),
-                {
-                    "user_id": user_id,
-                    "course_id": course_id,
-                    "lesson_id": lesson.id
-                }
-            )
+        await enroll_users(db, course_id, [user_id])
         
-        db.commit()
+        await db.commit()
+        invalidate_auth_context(user_ids=[user_id])
         return {"status": "success", "message": "Пользователь зачислен на курс"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Отчисление пользователя с курса
 @user_router.delete("/dismiss/{course_id}")
-def dismiss_user_to_course(course_id: int, request: EmailTokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def dismiss_user_to_course(course_id: int, request: EmailTokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Ошибка доступа"
         )
     
     try:
-        user_id = get_user_by_email(db, request.email)
-        result = db.execute(
-            text("SELECT id FROM usersprogress WHERE user_id = :user_id AND course_id = :course_id"),
+        user_id = await get_user_by_email(db, request.email)
+        result = (await db.execute(
+            text("SELECT id FROM enrollments WHERE user_id = :user_id AND course_id = :course_id"),
             {"user_id": user_id, "course_id": course_id}
-        ).fetchone()
+        )).fetchone()
 
         if not result:
             raise HTTPException(status_code=400, detail="Пользователь не зачислен на данный курс")
         
-        lessons = db.execute(
-            text("SELECT id FROM lessons WHERE course_id = :course_id"),
-            {"course_id": course_id}
-        ).fetchall()
-
-        for lesson in lessons:
-            db.execute(
-                text("""
-                    DELETE FROM usersprogress 
-                    WHERE user_id = :user_id AND course_id = :course_id AND lesson_id = :lesson_id
-                """),
-                {
-                    "user_id": user_id,
-                    "course_id": course_id,
-                    "lesson_id": lesson.id
-                }
-            )
+        await dismiss_users(db, course_id, [user_id])
         
-        db.commit()
+        await db.commit()
+        invalidate_auth_context(user_ids=[user_id])
         return {"status": "success", "message": "Пользователь отчислен с курса"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
+
+# Массовое зачисление/отчисление пользователей на курс
+async def bulk_enrollment(db, course_id: int, token: str, emails, enroll: bool):
+    await check_token_expiry(db, token)
+    if not await is_admin(db, token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Ошибка доступа"
+        )
+
+    try:
+        course = (await db.execute(
+            text("SELECT id FROM courses WHERE id = :course_id"),
+            {"course_id": course_id}
+        )).fetchone()
+
+        if not course:
+            raise HTTPException(status_code=404, detail="Курс не найден")
+
+        results = []
+        batch = []
+        async for email in emails:
+            batch.append(email)
+            if len(batch) >= BULK_ENROLLMENT_BATCH_SIZE:
+                results.extend(await process_enrollment_batch(db, course_id, batch, enroll))
+                batch = []
+
+        if batch:
+            results.extend(await process_enrollment_batch(db, course_id, batch, enroll))
+
+        await db.commit()
+
+        changed_status = "enrolled" if enroll else "dismissed"
+        invalidate_auth_context(user_ids=[result["user_id"] for result in results if result["status"] == changed_status])
+
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+
+        return {
+            "status": "success",
+            "course_id": course_id,
+            "counts": counts,
+            "results": results
+        }
+
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+async def iterate_emails(emails: list):
+    for email in emails:
+        yield email
+
+# Массовое зачисление пользователей на курс по списку Email
+@user_router.post("/enroll/{course_id}/bulk")
+async def bulk_enroll_users_to_course(course_id: int, request: BulkEmailTokenRequest, db: AsyncSession = Depends(get_db)):
+    return await bulk_enrollment(db, course_id, request.token, iterate_emails(request.emails), enroll=True)
+
+# Массовое зачисление пользователей на курс из CSV (первая колонка — Email), токен передаётся в заголовке token
+@user_router.post("/enroll/{course_id}/bulk-csv")
+async def bulk_enroll_users_to_course_csv(course_id: int, request: Request, token: str = Header(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_enrollment(db, course_id, token, read_csv_emails(request), enroll=True)
+
+# Массовое отчисление пользователей с курса по списку Email
+@user_router.delete("/dismiss/{course_id}/bulk")
+async def bulk_dismiss_users_from_course(course_id: int, request: BulkEmailTokenRequest, db: AsyncSession = Depends(get_db)):
+    return await bulk_enrollment(db, course_id, request.token, iterate_emails(request.emails), enroll=False)
+
+# Массовое отчисление пользователей с курса из CSV (первая колонка — Email), токен передаётся в заголовке token
+@user_router.delete("/dismiss/{course_id}/bulk-csv")
+async def bulk_dismiss_users_from_course_csv(course_id: int, request: Request, token: str = Header(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_enrollment(db, course_id, token, read_csv_emails(request), enroll=False)
 
 # Выдача пользователю прав администратора
 @user_router.put("/make-admin")
-def dismiss_user_to_course(request: EmailTokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    if not is_admin(db, request.token):
+async def dismiss_user_to_course(request: EmailTokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    if not await is_admin(db, request.token):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Ошибка доступа"
         )
     
     try:
-        user_id = get_user_by_email(db, request.email)
-        result = db.execute(
+        user_id = await get_user_by_email(db, request.email)
+        result = (await db.execute(
             text("SELECT id, firstname, surname FROM users WHERE id = :user_id"),
             {"user_id": user_id}
-        ).fetchone()
+        )).fetchone()
 
         if not result:
             raise HTTPException(status_code=400, detail="Пользователь с указанным Email не найден")
         
-        db.execute(
+        await db.execute(
             text("UPDATE users SET is_admin = TRUE WHERE id = :user_id"),
             {"user_id": user_id}
         )
 
-        db.commit()
+        await db.commit()
+        invalidate_auth_context(user_ids=[user_id])
         return {"status": "success", "message": "Пользователь был назначен администратором"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Получение всех достижений пользователя
 @user_router.post("/badges-list")
-def get_badges(request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    user_id = get_user_by_token(db, request.token)
+async def get_badges(
+    request: TokenRequest,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_db),
+):
+    await check_token_expiry(db, request.token)
+    user_id = await get_user_by_token(db, request.token)
     
     try:
-        badges = db.execute(
-            text("""
-                SELECT b.id, b.name, b.description
-                FROM user_badges ub
-                JOIN badges b ON ub.badge_id = b.id
-                WHERE ub.user_id = :user_id
-                ORDER BY ub.created_at DESC
-            """),
-            {"user_id": user_id}
-        ).fetchall()
-        
-        if not badges:
+        filters = ["ub.user_id = :user_id"]
+        params = {"user_id": user_id, "limit": limit + 1}
+
+        if cursor:
+            params["created_at"], params["after_id"] = decode_cursor(cursor, datetime.fromisoformat, int)
+            filters.append("(ub.created_at, ub.id) < (:created_at, :after_id)")
+
+        query = f"""
+            SELECT ub.id AS user_badge_id, ub.created_at, b.id, b.name, b.description
+            FROM user_badges ub
+            JOIN badges b ON ub.badge_id = b.id
+            WHERE {' AND '.join(filters)}
+            ORDER BY ub.created_at DESC, ub.id DESC
+            LIMIT :limit
+        """
+        badges = (await db.execute(text(query), params)).fetchall()
+        
+        if not badges and cursor is None:
             raise HTTPException(status_code=404, detail="Достижения не найдены")
+
+        badges, next_cursor = split_page(badges, limit, lambda badge: (badge.created_at, badge.user_badge_id))
         
         badges_list = []
         for badge in badges:
@@ -478,29 +620,27 @@ def get_badges(request: TokenRequest):
         return {
             "status": "success",
             "count_badges": len(badges_list),
-            "badges": badges_list
+            "badges": badges_list,
+            "next_cursor": next_cursor
         }
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Получение статистики пользователя
 @user_router.post("/stats")
-def get_stats(request: TokenRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    user_id = get_user_by_token(db, request.token)
+async def get_stats(request: TokenRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    user_id = await get_user_by_token(db, request.token)
 
     try:
-        stats = db.execute(
+        stats = (await db.execute(
             text("SELECT * FROM usersprogress_stats WHERE user_id = :user_id"), {"user_id": user_id}
-        ).fetchone()
+        )).fetchone()
         
         if not stats:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -514,36 +654,33 @@ def get_stats(request: TokenRequest):
         }
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
 
 # Изменение пароля
 @user_router.put("/change-password")
-def change_password(request: ChangePasswordRequest):
-    db = SessionLocal()
-    check_token_expiry(db, request.token)
-    user_id = get_user_by_token(db, request.token)
+async def change_password(request: ChangePasswordRequest, db: AsyncSession = Depends(get_db)):
+    await check_token_expiry(db, request.token)
+    user_id = await get_user_by_token(db, request.token)
     
     try:
-        user = db.execute(
+        user = (await db.execute(
             text("SELECT password_hash FROM users WHERE id = :user_id"),
             {"user_id": user_id}
-        ).fetchone()
+        )).fetchone()
         
         if not user:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        if not verify_text_hash(request.current_password, user.password_hash):
+        if not await passwords.verify_password(request.current_password, user.password_hash):
             raise HTTPException(status_code=400, detail="Неверный текущий пароль")
         
-        new_password_hash = get_text_hash(request.new_password)
+        new_password_hash = await passwords.hash_password(request.new_password)
         
-        db.execute(
+        await db.execute(
             text("UPDATE users SET password_hash = :password_hash WHERE id = :user_id"),
             {
                 "password_hash": new_password_hash,
@@ -551,14 +688,12 @@ def change_password(request: ChangePasswordRequest):
             }
         )
         
-        db.commit()
+        await db.commit()
         return {"status": "success", "message": "Пароль успешно изменен"}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
-    finally:
-        db.close()
\ No newline at end of file
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
\ No newline at end of file
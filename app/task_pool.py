@@ -0,0 +1,185 @@
+import asyncio
+import os
+import re
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from app import ai, metrics, retrieval
+from app.database import db_session
+
+load_dotenv()
+
+TASK_POOL_ENABLED = os.getenv("TASK_POOL_ENABLED", "true").lower() == "true"
+TASK_POOL_WATERMARK = int(os.getenv("TASK_POOL_WATERMARK", 5))
+TASK_POOL_REFILL_INTERVAL_SECONDS = float(os.getenv("TASK_POOL_REFILL_INTERVAL_SECONDS", 30))
+TASK_POOL_REFILL_CONCURRENCY = int(os.getenv("TASK_POOL_REFILL_CONCURRENCY", 2))
+TASK_POOL_ACTIVE_DAYS = int(os.getenv("TASK_POOL_ACTIVE_DAYS", 7))
+
+_worker = None
+_wakeup = None
+_requested_lessons = set()
+
+# Промпт для генерации задачи по уроку
+def build_task_prompt(lesson) -> str:
+    return f"""
+            Сгенерируй одну практическую задачу по уроку:
+            1) Название урока: {lesson.title}
+            2) Описание урока: {lesson.description}
+            3) Обучающий контент: {retrieval.build_context(lesson, f"{lesson.title} {lesson.description}")}
+
+            Задача должна быть уникальной и проверять понимание ключевых концепций.
+            Уровень сложности - начальный. Предоставь эталонное решение для проверки.
+
+            Твой ответ должен СТРОГО соответствовать шаблону:
+            Задача: [текст задачи]
+            Эталонное решение: [решение задачи]
+
+            ЗАПРЕЩЕНО использовать Markdown, обратные кавычки ```, символы форматирования!
+            Решение должно быть написано обычным текстом в одну строку!"""
+
+def clean_markdown(text):
+    text = re.sub(r'```[a-z]*\n?', '', text)
+    text = text.replace('```', '')
+    text = text.replace('**', '').replace('*', '').replace('_', '')
+    text = re.sub(r'\n+', ' ', text)
+    return text.strip()
+
+# Разбор ответа нейросети на текст задачи и эталонное решение
+def parse_task_response(response: str) -> tuple:
+    clean_response = clean_markdown(response)
+
+    if 'Эталонное решение:' in clean_response:
+        parts = clean_response.split('Эталонное решение:', 1)
+        task = parts[0].replace('Задача:', '').strip()
+        answer_right = parts[1].strip()
+    elif 'эталонное решение:' in clean_response:
+        parts = clean_response.split('эталонное решение:', 1)
+        task = parts[0].replace('Задача:', '').strip()
+        answer_right = parts[1].strip()
+    else:
+        task = clean_response.strip()
+        answer_right = ""
+
+    return task, answer_right
+
+# Атомарное получение готовой задачи из пула: параллельные запросы не ждут друг друга и не получают одну задачу
+async def claim_task(db, lesson_id: int):
+    if not TASK_POOL_ENABLED:
+        return None
+
+    claimed = (await db.execute(
+        text("""
+            DELETE FROM task_pool
+            WHERE id = (
+                SELECT id FROM task_pool
+                WHERE lesson_id = :lesson_id
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING task, answer_right
+        """),
+        {"lesson_id": lesson_id}
+    )).fetchone()
+
+    metrics.inc("task_pool_hits_total" if claimed else "task_pool_misses_total")
+    return claimed
+
+# Просьба пополнить пул урока при следующем проходе (пул оказался пуст)
+def request_refill(lesson_id: int):
+    _requested_lessons.add(lesson_id)
+    if _wakeup is not None:
+        _wakeup.set()
+
+# Удаление задач урока из пула после изменения урока (запись в БД фиксируется вызывающим кодом)
+async def discard_lesson(db, lesson_id: int):
+    await db.execute(
+        text("DELETE FROM task_pool WHERE lesson_id = :lesson_id"),
+        {"lesson_id": lesson_id}
+    )
+
+# Генерация одной задачи и добавление её в пул (без объединения одинаковых запросов - нужны разные задачи)
+async def _generate_into_pool(lesson, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        try:
+            task, answer_right = parse_task_response(await ai.chat(build_task_prompt(lesson), coalesce=False))
+        except Exception:
+            metrics.inc("task_pool_generation_errors_total")
+            return
+
+        if not task or not answer_right:
+            metrics.inc("task_pool_generation_errors_total")
+            return
+
+        async with db_session() as db:
+            await db.execute(
+                text("INSERT INTO task_pool (lesson_id, task, answer_right) VALUES (:lesson_id, :task, :answer_right)"),
+                {"lesson_id": lesson.id, "task": task, "answer_right": answer_right}
+            )
+            await db.commit()
+        metrics.inc("task_pool_generated_total")
+
+# Один проход пополнения: уроки, по которым недавно генерировались задачи или пул которых опустел,
+# дополняются до TASK_POOL_WATERMARK задач
+async def refill_pool():
+    requested = list(_requested_lessons)
+    _requested_lessons.clear()
+
+    async with db_session() as db:
+        lessons = (await db.execute(
+            text("""
+                SELECT l.id, l.title, l.description, l.education_content,
+                       (SELECT COUNT(*) FROM task_pool p WHERE p.lesson_id = l.id) AS pooled
+                FROM lessons l
+                WHERE l.id = ANY(CAST(:requested AS INTEGER[]))
+                   OR EXISTS (
+                       SELECT 1 FROM tasks t
+                       WHERE t.lesson_id = l.id AND t.created_at > NOW() - make_interval(days => :active_days)
+                   )
+            """),
+            {"requested": requested, "active_days": TASK_POOL_ACTIVE_DAYS}
+        )).fetchall()
+
+    semaphore = asyncio.Semaphore(TASK_POOL_REFILL_CONCURRENCY)
+    await asyncio.gather(*(
+        _generate_into_pool(lesson, semaphore)
+        for lesson in lessons
+        for _ in range(TASK_POOL_WATERMARK - lesson.pooled)
+    ))
+
+async def _run_worker():
+    while True:
+        try:
+            await refill_pool()
+        except Exception as e:
+            metrics.inc("task_pool_refill_errors_total")
+            print(f"Ошибка пополнения пула задач: {str(e)}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), TASK_POOL_REFILL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+# Запуск фонового пополнения пула задач (в lifespan приложения)
+def start_task_pool_worker():
+    global _worker, _wakeup
+    if not TASK_POOL_ENABLED or _worker is not None:
+        return
+
+    _wakeup = asyncio.Event()
+    _worker = asyncio.create_task(_run_worker())
+
+# Остановка фонового пополнения пула задач
+async def stop_task_pool_worker():
+    global _worker, _wakeup
+    if _worker is None:
+        return
+
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    _worker = None
+    _wakeup = None
@@ -1,25 +1,43 @@
+import base64
+from dataclasses import dataclass
+import anyio
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import partial
 import json
 import os
 import re
+from typing import Optional
 from dotenv import load_dotenv
 from fastapi import HTTPException
-import gigachat
 from sqlalchemy import text
-from gigachat import GigaChat
 import hashlib
 from json_repair import repair_json
 
+from app import ai, badges
+from app.cache import TTLCache
+
 load_dotenv()
 
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", 30))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", 10000))
+
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", 50))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", 200))
+
+BLOCKING_THREADS = {
+    "smtp": int(os.getenv("SMTP_THREADS", 4)),
+}
+_blocking_limiters = {}
+
 # Проверка существования токена
-def is_existing_token(db, token: str) -> bool:
-    result = db.execute(
+async def is_existing_token(db, token: str) -> bool:
+    result = (await db.execute(
         text("SELECT id FROM personal_access_tokens WHERE token = :token"),
         {
             "token": hash_token(token),
         }
-    ).fetchone()
+    )).fetchone()
     
     if not result: return False
     return True
@@ -28,46 +46,88 @@ def is_existing_token(db, token: str) -> bool:
 def hash_token(token: str) -> str:
     return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
-# Проверка срока действия токена
-def check_token_expiry(db, token: str) -> bool:
-    result = db.execute(
-        text("SELECT id, expires_at FROM personal_access_tokens WHERE token = :token"),
-        {"token": hash_token(token)}
-    ).fetchone()
+# Контекст авторизации: всё, что нужно эндпоинтам для проверки доступа по токену
+@dataclass(frozen=True)
+class AuthContext:
+    token_id: int
+    user_id: int
+    is_admin: bool
+    expires_at: Optional[datetime]
+    course_ids: frozenset
+
+_auth_cache = TTLCache(maxsize=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+
+# Получение контекста авторизации (одним запросом к БД, с кэшированием по хэшу токена)
+async def get_auth_context(db, token: str) -> AuthContext:
+    if not token:
+        raise HTTPException(status_code=401, detail="Токен не найден")
+
+    token_hash = hash_token(token)
+    context = _auth_cache.get(token_hash)
+    if context is not None:
+        return context
+
+    result = (await db.execute(
+        text("""
+            SELECT pat.id, pat.user_id, pat.expires_at, u.is_admin,
+                ARRAY(SELECT e.course_id FROM enrollments e WHERE e.user_id = pat.user_id) AS course_ids
+            FROM personal_access_tokens pat
+            JOIN users u ON u.id = pat.user_id
+            WHERE pat.token = :token
+        """),
+        {"token": token_hash}
+    )).fetchone()
 
     if not result:
         raise HTTPException(status_code=401, detail="Токен не найден")
+
+    context = AuthContext(
+        token_id=result.id,
+        user_id=result.user_id,
+        is_admin=bool(result.is_admin),
+        expires_at=result.expires_at,
+        course_ids=frozenset(result.course_ids or ()),
+    )
+    _auth_cache.set(token_hash, context)
+    return context
+
+# Сброс кэша авторизации по токену и/или по пользователям
+def invalidate_auth_context(token: str = None, token_hash: str = None, user_ids=None):
+    if token is not None:
+        token_hash = hash_token(token)
+
+    if token_hash is not None:
+        _auth_cache.pop(token_hash)
+
+    if user_ids:
+        user_ids = set(user_ids)
+        _auth_cache.discard_where(lambda context: context.user_id in user_ids)
+
+# Проверка срока действия токена
+async def check_token_expiry(db, token: str) -> bool:
+    context = await get_auth_context(db, token)
     
-    token_id, expires_at = result
-    
-    if expires_at and expires_at < datetime.now(timezone.utc):
-        db.execute(
+    if context.expires_at and context.expires_at < datetime.now(timezone.utc):
+        await db.execute(
             text("DELETE FROM personal_access_tokens WHERE id = :id"),
-            {"id": token_id}
+            {"id": context.token_id}
         )
-        db.commit()
+        await db.commit()
+        invalidate_auth_context(token=token)
         raise HTTPException(status_code=401, detail="Токен недействителен")
     
     return True
 
 # Получение user_id по токену
-def get_user_by_token(db, token: str) -> int:
-    result = db.execute(
-        text("SELECT user_id FROM personal_access_tokens WHERE token = :token"),
-        {"token": hash_token(token)}
-    ).fetchone()
-
-    if not result:
-        raise HTTPException(status_code=401, detail="Токен не найден")
-
-    return result[0]
+async def get_user_by_token(db, token: str) -> int:
+    return (await get_auth_context(db, token)).user_id
 
 # Получение user_id по Email
-def get_user_by_email(db, email: str) -> int:
-    result = db.execute(
+async def get_user_by_email(db, email: str) -> int:
+    result = (await db.execute(
         text("SELECT id FROM users WHERE email = :email"),
         {"email": email}
-    ).fetchone()
+    )).fetchone()
 
     if not result:
         raise HTTPException(status_code=401, detail="Пользователь с таким Email не найден")
@@ -75,163 +135,159 @@ def get_user_by_email(db, email: str) -> int:
     return result[0]
 
 # Проверка пользователя на роль администратора
-def is_admin(db, token: str) -> bool:
-    user_id = get_user_by_token(db, token)
-    
-    user_is_admin = db.execute(
-        text("SELECT is_admin FROM users WHERE id = :user_id"),
-        {"user_id": user_id}
-    ).fetchone()
-    
-    if not user_is_admin:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    
-    return user_is_admin[0]
+async def is_admin(db, token: str) -> bool:
+    return (await get_auth_context(db, token)).is_admin
 
 # Проверка пользователя на участие в курсе
-def is_user_in_course(db, token: str, course_id: int) -> bool:
-    user_id = get_user_by_token(db, token)
-
-    response = db.execute(
-        text("""
-            SELECT id
-            FROM usersprogress 
-            WHERE user_id = :user_id AND course_id = :course_id
-        """),
-        {"user_id": user_id, "course_id": course_id}
-    ).fetchone()
-
-    if response is not None:
-        return True
-    
-    return False
+async def is_user_in_course(db, token: str, course_id: int) -> bool:
+    return course_id in (await get_auth_context(db, token)).course_ids
 
 # Получение курса по идентификатору урока
-def get_course_by_lesson(db, lesson_id: int) -> int:
-    result = db.execute(
+async def get_course_by_lesson(db, lesson_id: int) -> int:
+    result = (await db.execute(
         text("SELECT course_id FROM lessons WHERE id = :lesson_id"),
         {"lesson_id": lesson_id}
-    ).fetchone()
+    )).fetchone()
 
     if not result:
         raise HTTPException(status_code=401, detail="Урок не найден")
 
     return result[0]
 
+# Поля урока, которые можно запросить через fields=, и их краткий набор (без тяжёлого содержимого)
+LESSON_FIELDS = ("id", "title", "description", "education_content", "course_id", "duration_minutes")
+LESSON_SUMMARY_FIELDS = tuple(field for field in LESSON_FIELDS if field != "education_content")
+
+# Разбор параметра fields: "summary" или список полей через запятую. id возвращается всегда (по нему строится курсор)
+def parse_fields(fields: Optional[str], allowed: tuple, summary: tuple) -> list:
+    if fields is None:
+        return list(allowed)
+    if fields.strip() == "summary":
+        return list(summary)
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(sorted(unknown))}")
+
+    return [field for field in allowed if field == "id" or field in requested]
+
+# Курсор пагинации: значения ключа последней записи страницы, закодированные в base64
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, default=lambda value: value.isoformat()).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+# Разбор курсора: каждое значение приводится функцией из types (int, datetime.fromisoformat, ...)
+def decode_cursor(cursor: str, *types) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return [convert(value) for convert, value in zip(types, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+# Разбиение выборки из limit + 1 строк на страницу и курсор следующей страницы
+def split_page(rows: list, limit: int, key) -> tuple:
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+# Строгий ETag для тела ответа
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+# Проверка заголовка If-None-Match на совпадение с ETag
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+# Проверка заголовка If-Modified-Since (точность HTTP-даты - секунда)
+def is_not_modified_since(if_modified_since: Optional[str], updated_at: datetime) -> bool:
+    if not if_modified_since:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return updated_at.replace(microsecond=0) <= since
+
+# Выполнение блокирующей функции в отдельном потоке, чтобы не останавливать цикл событий.
+# Для каждого вида работы (smtp) свой лимит потоков, чтобы медленный внешний сервис не занял их все
+async def run_blocking(kind: str, func, *args):
+    limiter = _blocking_limiters.get(kind)
+    if limiter is None:
+        limiter = _blocking_limiters[kind] = anyio.CapacityLimiter(BLOCKING_THREADS[kind])
+
+    return await anyio.to_thread.run_sync(partial(func, *args), limiter=limiter)
+
 # Запрос к нейросети GigaChat
-def query_ai(prompt: str):
+async def query_ai(prompt: str):
     try:
-        token = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
-        giga = gigachat.GigaChat(
-            credentials=token,
-            verify_ssl_certs=False,
-            scope="GIGACHAT_API_PERS"
-        )
-        
-        response = giga.chat(prompt)
-        return response.choices[0].message.content
+        return await ai.chat(prompt)
         
+    except HTTPException:
+        raise
     except Exception as e:
         return f"Ошибка: {str(e)}"
     
-# Обработка достижений
-def process_achievement_event(db, badge_type: str, user_id: int, task_complete: bool = None):
-    stats = db.execute(
-        text("SELECT * FROM usersprogress_stats WHERE user_id = :user_id"),
-        {"user_id": user_id}
-    ).fetchone()
-    
-    if not stats:
-        db.execute(
-            text("INSERT INTO usersprogress_stats (user_id) VALUES (:user_id)"),
-            {"user_id": user_id}
-        )
-        stats = db.execute(
-            text("SELECT * FROM usersprogress_stats WHERE user_id = :user_id"),
+# Увеличение счётчика статистики одним запросом (строка статистики создаётся при первом событии).
+# Событие -> (тип достижений, запрос, возвращающий новое значение счётчика)
+ACHIEVEMENT_COUNTERS = {
+    "lesson_complete": ("lesson_complete", """
+        INSERT INTO usersprogress_stats (user_id, lesson_complete) VALUES (:user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE
+        SET lesson_complete = COALESCE(usersprogress_stats.lesson_complete, 0) + 1, updated_at = NOW()
+        RETURNING lesson_complete
+    """),
+    "task_completed": ("tasks_streak", """
+        INSERT INTO usersprogress_stats (user_id, tasks_streak, max_streak) VALUES (:user_id, 1, 1)
+        ON CONFLICT (user_id) DO UPDATE
+        SET tasks_streak = COALESCE(usersprogress_stats.tasks_streak, 0) + 1,
+            max_streak = GREATEST(COALESCE(usersprogress_stats.max_streak, 0), COALESCE(usersprogress_stats.tasks_streak, 0) + 1),
+            updated_at = NOW()
+        RETURNING tasks_streak
+    """),
+    "course_complete": ("course_complete", """
+        INSERT INTO usersprogress_stats (user_id, course_complete) VALUES (:user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE
+        SET course_complete = COALESCE(usersprogress_stats.course_complete, 0) + 1, updated_at = NOW()
+        RETURNING course_complete
+    """),
+}
+
+# Обработка достижений: счётчик увеличивается на 1, выдаются только достижения, порог которых пройден этим событием.
+# Изменения фиксирует вызывающий код (обработчик событий в app/achievements.py)
+async def process_achievement_event(db, badge_type: str, user_id: int, task_complete: bool = None):
+    if badge_type == "task_completed" and task_complete != True:
+        await db.execute(
+            text("""
+                INSERT INTO usersprogress_stats (user_id, tasks_streak) VALUES (:user_id, 0)
+                ON CONFLICT (user_id) DO UPDATE SET tasks_streak = 0, updated_at = NOW()
+            """),
             {"user_id": user_id}
-        ).fetchone()
-    
-    if badge_type == "lesson_complete":
-        new_lesson_count = stats.lesson_complete + 1
-        db.execute(
-            text("UPDATE usersprogress_stats SET lesson_complete = :count WHERE user_id = :user_id"),
-            {"count": new_lesson_count, "user_id": user_id}
         )
-    
-        achievements = db.execute(
-            text("SELECT * FROM badges WHERE badge_type = 'lesson_complete' AND badge_value <= :count"),
-            {"count": new_lesson_count}
-        ).fetchall()
-        
-        for achievement in achievements:
-            existing = db.execute(
-                text("SELECT * FROM user_badges WHERE user_id = :user_id AND badge_id = :badge_id"),
-                {"user_id": user_id, "badge_id": achievement.id}
-            ).fetchone()
-            
-            if not existing:
-                db.execute(
-                    text("INSERT INTO user_badges (user_id, badge_id) VALUES (:user_id, :badge_id)"),
-                    {"user_id": user_id, "badge_id": achievement.id}
-                )
-    
-    elif badge_type == "task_completed":
-        if task_complete == True:
-            new_streak = stats.tasks_streak + 1
-            db.execute(
+    elif badge_type in ACHIEVEMENT_COUNTERS:
+        threshold_type, counter_sql = ACHIEVEMENT_COUNTERS[badge_type]
+        new_value = (await db.execute(text(counter_sql), {"user_id": user_id})).scalar()
+
+        catalog = await badges.get_badge_catalog(db)
+        badge_ids = badges.crossed_badges(catalog, threshold_type, new_value - 1, new_value)
+        if badge_ids:
+            await db.execute(
                 text("""
-                    UPDATE usersprogress_stats 
-                    SET tasks_streak = :streak, 
-                        max_streak = GREATEST(max_streak, :streak) 
-                    WHERE user_id = :user_id
+                    INSERT INTO user_badges (user_id, badge_id)
+                    SELECT :user_id, unnest(CAST(:badge_ids AS INTEGER[]))
+                    ON CONFLICT (user_id, badge_id) DO NOTHING
                 """),
-                {"streak": new_streak, "user_id": user_id}
+                {"user_id": user_id, "badge_ids": badge_ids}
             )
-            
-            streak_achievements = db.execute(
-                text("SELECT * FROM badges WHERE badge_type = 'tasks_streak' AND badge_value <= :streak"),
-                {"streak": new_streak}
-            ).fetchall()
-            
-            for achievement in streak_achievements:
-                existing = db.execute(
-                    text("SELECT * FROM user_badges WHERE user_id = :user_id AND badge_id = :badge_id"),
-                    {"user_id": user_id, "badge_id": achievement.id}
-                ).fetchone()
-                
-                if not existing:
-                    db.execute(
-                        text("INSERT INTO user_badges (user_id, badge_id) VALUES (:user_id, :badge_id)"),
-                        {"user_id": user_id, "badge_id": achievement.id}
-                    )
-        else:
-            db.execute(
-                text("UPDATE usersprogress_stats SET tasks_streak = 0 WHERE user_id = :user_id"),
-                {"user_id": user_id}
-            )
-    
-    elif badge_type == "course_complete":
-        new_course_count = stats.course_complete + 1
-        db.execute(
-            text("UPDATE usersprogress_stats SET course_complete = :count WHERE user_id = :user_id"),
-            {"count": new_course_count, "user_id": user_id}
-        )
-        
-        course_achievements = db.execute(
-            text("SELECT * FROM badges WHERE badge_type = 'course_complete' AND badge_value <= :count"),
-            {"count": new_course_count}
-        ).fetchall()
-        
-        for achievement in course_achievements:
-            existing = db.execute(
-                text("SELECT * FROM user_badges WHERE user_id = :user_id AND badge_id = :badge_id"),
-                {"user_id": user_id, "badge_id": achievement.id}
-            ).fetchone()
-            
-            if not existing:
-                db.execute(
-                    text("INSERT INTO user_badges (user_id, badge_id) VALUES (:user_id, :badge_id)"),
-                    {"user_id": user_id, "badge_id": achievement.id}
-                )
-    
-    db.commit()
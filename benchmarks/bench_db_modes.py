@@ -0,0 +1,108 @@
+# Сравнение пропускной способности API в двух режимах работы с БД:
+# DB_ASYNC_MODE=false (psycopg2 в пуле потоков) и DB_ASYNC_MODE=true (asyncpg).
+# Для каждого режима поднимается отдельный сервер uvicorn, затем нагружаются /api/course и /api/lesson.
+#
+# Запуск (база данных должна быть настроена через setup.py):
+#   python benchmarks/bench_db_modes.py --duration 20 --concurrency 64
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Ожидание запуска сервера
+async def wait_for_server(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/")
+            if response.status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Сервер не запустился")
+
+# Нагрузка одного эндпоинта в течение duration секунд
+async def load_endpoint(client: httpx.AsyncClient, method: str, path: str, body, duration: float, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                if response.status_code >= 500:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        "errors": errors,
+    }
+
+async def bench_mode(async_mode: bool, args) -> dict:
+    env = {**os.environ, "DB_ASYNC_MODE": "true" if async_mode else "false"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=30) as client:
+            await wait_for_server(client)
+
+            login = await client.post("/api/user/login", json={"email": args.email, "password": args.password})
+            login.raise_for_status()
+            token = login.json()["token"]
+
+            results = {}
+            for name, method, path, body in (
+                ("/api/course", "GET", "/api/course", None),
+                ("/api/lesson", "POST", "/api/lesson", {"token": token}),
+            ):
+                await load_endpoint(client, method, path, body, min(args.duration, 3), args.concurrency)
+                results[name] = await load_endpoint(client, method, path, body, args.duration, args.concurrency)
+
+            await client.request("DELETE", "/api/user/logout", json={"token": token})
+            return results
+    finally:
+        server.terminate()
+        server.wait()
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--email", default="user@example.com")
+    parser.add_argument("--password", default="user")
+    args = parser.parse_args()
+
+    print(f"{'режим':<10} {'эндпоинт':<12} {'req/s':>10} {'p50, мс':>10} {'p95, мс':>10} {'ошибки':>8}")
+    for async_mode in (False, True):
+        mode = "asyncpg" if async_mode else "psycopg2"
+        for endpoint, result in (await bench_mode(async_mode, args)).items():
+            print(f"{mode:<10} {endpoint:<12} {result['rps']:>10.1f} {result['p50_ms']:>10.1f} {result['p95_ms']:>10.1f} {result['errors']:>8}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
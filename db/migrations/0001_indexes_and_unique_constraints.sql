@@ -0,0 +1,72 @@
+-- migrate: no-transaction
+-- Индексы для частых выборок и ограничения уникальности.
+-- Индексы строятся CONCURRENTLY, чтобы не блокировать запись в таблицы рабочей базы.
+
+-- Удаление дубликатов, которые помешают построить уникальные индексы
+DELETE FROM usersprogress a
+USING usersprogress b
+WHERE a.user_id = b.user_id AND a.course_id = b.course_id AND a.lesson_id = b.lesson_id AND a.id > b.id;
+
+DELETE FROM user_badges a
+USING user_badges b
+WHERE a.user_id = b.user_id AND a.badge_id = b.badge_id AND a.id > b.id;
+
+DELETE FROM usersprogress_stats a
+USING usersprogress_stats b
+WHERE a.user_id = b.user_id AND a.id > b.id;
+
+DELETE FROM personal_access_tokens a
+USING personal_access_tokens b
+WHERE a.token = b.token AND a.id > b.id;
+
+-- personal_access_tokens: поиск по токену и подсчёт/ротация токенов пользователя
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS personal_access_tokens_token_key
+    ON personal_access_tokens (token);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS personal_access_tokens_user_id_created_at_idx
+    ON personal_access_tokens (user_id, created_at);
+
+-- usersprogress: выборки по (user_id, course_id) используют префикс уникального индекса
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS usersprogress_user_course_lesson_key
+    ON usersprogress (user_id, course_id, lesson_id);
+
+-- lessons: уроки курса
+CREATE INDEX CONCURRENTLY IF NOT EXISTS lessons_course_id_idx
+    ON lessons (course_id);
+
+-- tasks: задачи пользователя
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_user_id_idx
+    ON tasks (user_id);
+
+-- user_badges: проверка выданного достижения
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS user_badges_user_badge_key
+    ON user_badges (user_id, badge_id);
+
+-- usersprogress_stats: одна строка статистики на пользователя
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS usersprogress_stats_user_id_key
+    ON usersprogress_stats (user_id);
+
+-- Превращение уникальных индексов в ограничения (без повторного построения индекса)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'personal_access_tokens_token_key') THEN
+        ALTER TABLE personal_access_tokens
+            ADD CONSTRAINT personal_access_tokens_token_key UNIQUE USING INDEX personal_access_tokens_token_key;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'usersprogress_user_course_lesson_key') THEN
+        ALTER TABLE usersprogress
+            ADD CONSTRAINT usersprogress_user_course_lesson_key UNIQUE USING INDEX usersprogress_user_course_lesson_key;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'user_badges_user_badge_key') THEN
+        ALTER TABLE user_badges
+            ADD CONSTRAINT user_badges_user_badge_key UNIQUE USING INDEX user_badges_user_badge_key;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'usersprogress_stats_user_id_key') THEN
+        ALTER TABLE usersprogress_stats
+            ADD CONSTRAINT usersprogress_stats_user_id_key UNIQUE USING INDEX usersprogress_stats_user_id_key;
+    END IF;
+END
+$$;
@@ -0,0 +1,30 @@
+-- Компактная модель прогресса: одна строка на зачисление (пользователь, курс)
+-- и массив идентификаторов пройденных уроков вместо строки на каждый урок курса.
+CREATE TABLE IF NOT EXISTS enrollments (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    course_id INTEGER NOT NULL,
+    completed_lesson_ids INTEGER[] NOT NULL DEFAULT '{}',
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+
+    CONSTRAINT enrollments_user_course_key UNIQUE (user_id, course_id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS enrollments_course_id_idx ON enrollments (course_id);
+
+-- Перенос существующего прогресса
+INSERT INTO enrollments (user_id, course_id, completed_lesson_ids, created_at, updated_at)
+SELECT
+    user_id,
+    course_id,
+    COALESCE(array_agg(lesson_id ORDER BY lesson_id) FILTER (WHERE is_completed), '{}'),
+    MIN(created_at),
+    MAX(updated_at)
+FROM usersprogress
+GROUP BY user_id, course_id
+ON CONFLICT (user_id, course_id) DO NOTHING;
+
+DROP TABLE usersprogress;
@@ -0,0 +1,13 @@
+-- Общий для всех процессов кэш ответов нейросети на вопросы по урокам.
+-- Ключ включает хэш содержимого урока, поэтому после изменения урока старые ответы не используются.
+CREATE TABLE IF NOT EXISTS ai_answer_cache (
+    lesson_id INTEGER NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    question_hash CHAR(64) NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+
+    PRIMARY KEY (lesson_id, content_hash, question_hash),
+    FOREIGN KEY (lesson_id) REFERENCES lessons(id) ON DELETE CASCADE
+);
@@ -0,0 +1,19 @@
+-- migrate: no-transaction
+-- Пул заранее сгенерированных задач по урокам: эндпоинт генерации забирает готовую задачу,
+-- фоновый процесс пополняет пул до заданного уровня.
+CREATE TABLE IF NOT EXISTS task_pool (
+    id SERIAL PRIMARY KEY,
+    lesson_id INTEGER NOT NULL,
+    task TEXT NOT NULL,
+    answer_right TEXT NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+
+    FOREIGN KEY (lesson_id) REFERENCES lessons(id) ON DELETE CASCADE
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_pool_lesson_id_idx
+    ON task_pool (lesson_id, id);
+
+-- tasks: уроки, по которым недавно генерировались задачи (их пул поддерживается заполненным)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_lesson_id_created_at_idx
+    ON tasks (lesson_id, created_at);
@@ -0,0 +1,14 @@
+-- Очередь событий для статистики и достижений (outbox): событие записывается в транзакции запроса,
+-- а статистика и достижения обновляются фоновым обработчиком пачками.
+CREATE TABLE IF NOT EXISTS achievement_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    event_type VARCHAR(50) NOT NULL,
+    task_complete BOOLEAN,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Выборка событий пользователя по порядку
+CREATE INDEX IF NOT EXISTS achievement_events_user_id_id_idx ON achievement_events (user_id, id);
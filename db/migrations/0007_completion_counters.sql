@@ -0,0 +1,17 @@
+-- Счётчики для проверки завершения курса без агрегатных запросов:
+-- число уроков курса и число пройденных уроков в зачислении, поддерживаются приложением при изменениях.
+ALTER TABLE courses ADD COLUMN IF NOT EXISTS lessons_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE enrollments ADD COLUMN IF NOT EXISTS completed_count INTEGER NOT NULL DEFAULT 0;
+
+-- Заполнение счётчиков по текущим данным (из массива убираются уроки, которых уже нет в курсе)
+UPDATE courses c
+SET lessons_count = (SELECT COUNT(*) FROM lessons l WHERE l.course_id = c.id);
+
+UPDATE enrollments e
+SET completed_lesson_ids = COALESCE(
+        (SELECT array_agg(l.id ORDER BY l.id) FROM lessons l
+         WHERE l.id = ANY(e.completed_lesson_ids) AND l.course_id = e.course_id),
+        '{}'
+    );
+
+UPDATE enrollments SET completed_count = cardinality(completed_lesson_ids);
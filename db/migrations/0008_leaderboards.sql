@@ -0,0 +1,44 @@
+-- Рейтинги пользователей: считаются целиком при обновлении представлений (периодически, фоновым обработчиком),
+-- а не сортировкой всех пользователей при каждом запросе.
+CREATE MATERIALIZED VIEW IF NOT EXISTS leaderboard_global AS
+SELECT
+    s.user_id,
+    u.firstname,
+    u.surname,
+    COALESCE(s.lesson_complete, 0) AS lesson_complete,
+    COALESCE(s.course_complete, 0) AS course_complete,
+    COALESCE(s.max_streak, 0) AS max_streak,
+    RANK() OVER (ORDER BY COALESCE(s.lesson_complete, 0) DESC) AS lesson_complete_rank,
+    RANK() OVER (ORDER BY COALESCE(s.course_complete, 0) DESC) AS course_complete_rank,
+    RANK() OVER (ORDER BY COALESCE(s.max_streak, 0) DESC) AS max_streak_rank
+FROM usersprogress_stats s
+JOIN users u ON u.id = s.user_id;
+
+-- Рейтинг внутри курса: по урокам, пройденным в этом курсе, и по общей статистике участников курса
+CREATE MATERIALIZED VIEW IF NOT EXISTS leaderboard_course AS
+SELECT
+    e.course_id,
+    e.user_id,
+    u.firstname,
+    u.surname,
+    e.completed_count AS lesson_complete,
+    COALESCE(s.course_complete, 0) AS course_complete,
+    COALESCE(s.max_streak, 0) AS max_streak,
+    RANK() OVER (PARTITION BY e.course_id ORDER BY e.completed_count DESC) AS lesson_complete_rank,
+    RANK() OVER (PARTITION BY e.course_id ORDER BY COALESCE(s.course_complete, 0) DESC) AS course_complete_rank,
+    RANK() OVER (PARTITION BY e.course_id ORDER BY COALESCE(s.max_streak, 0) DESC) AS max_streak_rank
+FROM enrollments e
+JOIN users u ON u.id = e.user_id
+LEFT JOIN usersprogress_stats s ON s.user_id = e.user_id;
+
+-- Уникальные индексы нужны для REFRESH MATERIALIZED VIEW CONCURRENTLY и поиска места пользователя
+CREATE UNIQUE INDEX IF NOT EXISTS leaderboard_global_user_id_key ON leaderboard_global (user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS leaderboard_course_course_user_key ON leaderboard_course (course_id, user_id);
+
+-- Первые места по каждому показателю
+CREATE INDEX IF NOT EXISTS leaderboard_global_lesson_complete_rank_idx ON leaderboard_global (lesson_complete_rank, user_id);
+CREATE INDEX IF NOT EXISTS leaderboard_global_course_complete_rank_idx ON leaderboard_global (course_complete_rank, user_id);
+CREATE INDEX IF NOT EXISTS leaderboard_global_max_streak_rank_idx ON leaderboard_global (max_streak_rank, user_id);
+CREATE INDEX IF NOT EXISTS leaderboard_course_lesson_complete_rank_idx ON leaderboard_course (course_id, lesson_complete_rank, user_id);
+CREATE INDEX IF NOT EXISTS leaderboard_course_course_complete_rank_idx ON leaderboard_course (course_id, course_complete_rank, user_id);
+CREATE INDEX IF NOT EXISTS leaderboard_course_max_streak_rank_idx ON leaderboard_course (course_id, max_streak_rank, user_id);
@@ -0,0 +1,9 @@
+-- Отметка о завершении курса в зачислении: событие course_complete записывается один раз,
+-- даже если после завершения в курс добавили уроки и пользователь прошёл и их.
+ALTER TABLE enrollments ADD COLUMN IF NOT EXISTS course_completed_at TIMESTAMPTZ;
+
+UPDATE enrollments e
+SET course_completed_at = e.updated_at
+FROM courses c
+WHERE c.id = e.course_id AND c.lessons_count > 0 AND e.completed_count >= c.lessons_count
+  AND e.course_completed_at IS NULL;
@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Поиск устаревших ответов для очистки кэша
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ai_answer_cache_created_at_idx ON ai_answer_cache (created_at);
@@ -0,0 +1,9 @@
+-- Попытки обработки события достижений: событие, обработка которого падает ACHIEVEMENT_MAX_ATTEMPTS раз,
+-- откладывается (failed_at) и больше не выбирается обработчиком, чтобы не блокировать остальные события
+ALTER TABLE achievement_events ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE achievement_events ADD COLUMN IF NOT EXISTS failed_at TIMESTAMPTZ;
+ALTER TABLE achievement_events ADD COLUMN IF NOT EXISTS error TEXT;
+
+-- Выборка необработанных событий пользователя по порядку (отложенные события в индекс не входят)
+DROP INDEX IF EXISTS achievement_events_user_id_id_idx;
+CREATE INDEX IF NOT EXISTS achievement_events_pending_user_id_id_idx ON achievement_events (user_id, id) WHERE failed_at IS NULL;
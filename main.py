@@ -1,24 +1,64 @@
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
+import anyio
 from fastapi import FastAPI
 import uvicorn
+from app import metrics
+from app.achievements import start_achievement_worker, stop_achievement_worker
+from app.ai import close_ai_client, init_ai_client
+from app.database import dispose_engine, init_engine, warm_up_pool
+from app.jobs import start_job_workers, stop_job_workers
+from app.leaderboard import start_leaderboard_worker, stop_leaderboard_worker
+from app.migrations import run_migrations
+from app.passwords import start_password_pool, stop_password_pool
+from app.task_pool import start_task_pool_worker, stop_task_pool_worker
 from app.router.user import user_router
 from app.router.course import course_router
 from app.router.lesson import lesson_router
 from app.router.task import task_router
+from app.router.job import job_router
+from app.router.leaderboard import leaderboard_router
 
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.getenv("DB_MIGRATE_ON_STARTUP", "true").lower() == "true":
+        await anyio.to_thread.run_sync(run_migrations)
+    init_engine()
+    await warm_up_pool()
+    await start_password_pool()
+    init_ai_client()
+    start_task_pool_worker()
+    start_job_workers()
+    start_achievement_worker()
+    start_leaderboard_worker()
+    yield
+    await stop_leaderboard_worker()
+    await stop_achievement_worker()
+    await stop_job_workers()
+    await stop_task_pool_worker()
+    await close_ai_client()
+    stop_password_pool()
+    await dispose_engine()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(user_router)
 app.include_router(course_router)
 app.include_router(lesson_router)
 app.include_router(task_router)
+app.include_router(job_router)
+app.include_router(leaderboard_router)
 
 @app.get("/")
 async def health_check():
     return {"status": "ok", "services": ["edunextapi"]}
 
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     uvicorn.run(app, host=os.getenv("DEPLOY_HOST"), port=int(os.getenv("DEPLOY_PORT")))
\ No newline at end of file
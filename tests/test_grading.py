@@ -0,0 +1,54 @@
+import pytest
+
+from app.grading import normalize_answer, pre_grade
+
+@pytest.mark.parametrize("answer, answer_right", [
+    ("[1, 2]", "(1, 2)"),
+    ("len[s]", "len(s)"),
+    ("x[0]", "x(0)"),
+    ('"5"', "5"),
+    ("O(n)", "O[n]"),
+])
+def test_brackets_and_quotes_go_to_llm(answer, answer_right):
+    assert pre_grade(answer, answer_right) is None
+
+def test_brackets_exact_match():
+    assert pre_grade(" [1, 2] ", "[1, 2]") is True
+
+@pytest.mark.parametrize("answer, answer_right", [
+    ("1,000", "1"),
+    ("1,000", "1000"),
+    ("1.000,5", "1000.5"),
+    ("nan", "nan"),
+    ("inf", "1e999"),
+])
+def test_ambiguous_numbers_are_not_rejected(answer, answer_right):
+    assert pre_grade(answer, answer_right) is not False
+
+def test_ambiguous_number_is_not_accepted():
+    assert pre_grade("1,000", "1") is not True
+
+@pytest.mark.parametrize("answer, answer_right", [
+    ("5", "5,0"),
+    ("3,14", "3.14"),
+    ("-0.5", "-,5"),
+    ("1e3", "1000"),
+])
+def test_equal_numbers(answer, answer_right):
+    assert pre_grade(answer, answer_right) is True
+
+def test_different_numbers():
+    assert pre_grade("6", "5") is False
+
+def test_text_answers():
+    assert pre_grade("Ёлка!", "елка") is True
+    assert pre_grade("a больше b", "b больше a") is None
+    assert pre_grade("  ", "ответ") is False
+    assert pre_grade("ответ", "") is None
+
+def test_code_answers():
+    assert pre_grade("print( 'a' )", 'print("a")') is True
+    assert pre_grade("print(a)", "print(b)") is None
+
+def test_normalizer_keeps_brackets_and_quotes():
+    assert normalize_answer("Ответ: f(x) = \"да\"...") == "ответ f(x) = \"да\""